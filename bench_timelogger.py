@@ -0,0 +1,296 @@
+# Benchmarks of timelogger on synthetic data: large single days and multi-year
+# .timelogger trees. The results are written as JSON and compared against a
+# stored baseline, a regression makes the run exit with status 1. Timings
+# depend on the machine, so the baseline is not part of the repository: it is
+# recorded into bench_baseline.json in the current directory (--baseline picks
+# another file), and a run without one fails until it is recorded.
+#
+#   python3 bench_timelogger.py --save-baseline   record bench_baseline.json
+#   python3 bench_timelogger.py                   compare against it
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import timelogger
+from timelogger import AutoCompleter
+from timelogger import ScreenRenderer
+from timelogger import Task
+from timelogger import TimeBlock
+from timelogger import TimeLogger
+
+DEFAULT_BASELINE = 'bench_baseline.json'
+DEFAULT_OUTPUT = 'bench_output.txt'
+
+# timelogger_status.py runs in shell prompts: interpreter start, import and query together
+# have to stay below this many milliseconds, with or without a baseline
+STATUS_BUDGET_MS = 50
+
+def day_filename(day):
+    return day.strftime('%Y-%m-%d_%A.json')
+
+def synthetic_tasks(day, task_count, block_count, rng):
+    # block_count blocks spread over 06:00-22:00, each booked to a random task,
+    # without overlaps between the blocks
+    midnight = timelogger.day_clock(day).midnight
+    slot = 16 * 3600 / block_count
+    tasks = [Task(f"task {index}", day) for index in range(task_count)]
+    for index in range(block_count):
+        start = midnight + 6 * 3600 + index * slot
+        end = start + slot * rng.uniform(0.3, 1.0)
+        tasks[rng.randrange(task_count)].time_blocks.append(TimeBlock.from_timestamps(start, end))
+    return [task for task in tasks if task.block_count() > 0]
+
+def overlapping_task(day, block_count, overlap, rng):
+    # one task of block_count blocks, a share of overlap of them overlapping or
+    # touching their predecessor, as merge_touching_time_blocks has to handle
+    midnight = timelogger.day_clock(day).midnight
+    slot = 20 * 3600 / block_count
+    task = Task('overlapping', day)
+    for index in range(block_count):
+        start = midnight + 2 * 3600 + index * slot
+        length = slot * (rng.uniform(1.0, 1.5) if rng.random() < overlap else rng.uniform(0.3, 0.9))
+        task.time_blocks.append(TimeBlock.from_timestamps(start, start + length))
+    return task
+
+def write_day(directory, day, tasks):
+    tl = TimeLogger(os.path.join(directory, day_filename(day)))
+    tl.tasks = tasks
+    tl.needs_snapshot = True
+    tl.save_tasks_to_file()
+    return tl.filepath
+
+def write_history(directory, years, task_count, block_count, rng):
+    # a day file for every weekday of the last years
+    last_day = date(2024, 12, 31)
+    day = last_day - timedelta(days=365 * years)
+    count = 0
+    while day <= last_day:
+        if day.weekday() < 5:
+            write_day(directory, day, synthetic_tasks(day, task_count, block_count, rng))
+            count += 1
+        day += timedelta(days=1)
+    return count
+
+def backfill_commands(day, count, task_count, rng):
+    commands = []
+    for _ in range(count):
+        start = rng.randrange(6 * 4, 21 * 4)
+        end = start + rng.randrange(1, 8)
+        commands.append(f"task {rng.randrange(task_count)}={start // 4}:{start % 4 * 15:02d}-{end // 4}:{end % 4 * 15:02d}")
+    return commands
+
+def measure(run, setup=None, repeat=5):
+    # milliseconds of the fastest and the median run, setup is not timed
+    timings = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        started = time.perf_counter()
+        run(state)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {'min_ms': min(timings), 'median_ms': statistics.median(timings)}
+
+def status_startup(directory, workdir, repeat=5):
+    # the status script as a shell prompt runs it, in a new interpreter each time;
+    # the standard library may use its compiled modules, one run warms the disk cache
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPYCACHEPREFIX'] = os.path.abspath(os.path.join(workdir, 'pycache'))
+    script = os.path.join(os.path.dirname(os.path.abspath(timelogger.__file__)), 'timelogger_status.py')
+    command = [sys.executable, script, os.path.abspath(directory)]
+    def run_status(state):
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+    run_status(None)
+    return measure(run_status, repeat=repeat)
+
+def run_benchmarks(config, workdir):
+    rng = random.Random(config['seed'])
+    day = date(2024, 6, 3)
+    day_directory = os.path.join(workdir, 'day')
+    history_directory = os.path.join(workdir, 'history')
+    day_path = write_day(day_directory, day, synthetic_tasks(day, config['tasks'], config['blocks'], rng))
+    with open(day_path, 'rb') as file:
+        pristine = file.read()
+    commands = backfill_commands(day, config['commands'], config['tasks'], rng)
+    repeat = config['repeat']
+    results = {}
+
+    def load_decoded(state):
+        for task in TimeLogger(day_path).tasks:
+            task.time_blocks
+    results['load_file'] = measure(lambda state: TimeLogger(day_path), repeat=repeat)
+    results['load_file_decoded'] = measure(load_decoded, repeat=repeat)
+
+    def loaded_day():
+        tl = TimeLogger(day_path)
+        tl.needs_snapshot = True
+        tl.generation += 1
+        return tl
+    results['save_snapshot'] = measure(lambda tl: tl.save_tasks_to_file(), loaded_day, repeat)
+
+    def generated_day():
+        # every run starts from the generated day, without the log of earlier runs
+        with open(day_path, 'wb') as file:
+            file.write(pristine)
+        if os.path.exists(day_path + '.log'):
+            os.remove(day_path + '.log')
+        return TimeLogger(day_path)
+
+    def backfill(tl):
+        for command in commands:
+            tl.keep_history()
+            tl.command_create_rename_merge(command)
+    results['command_backfill'] = measure(backfill, generated_day, repeat)
+
+    def backfilled_day():
+        tl = generated_day()
+        backfill(tl)
+        return tl
+    results['save_after_backfill'] = measure(lambda tl: tl.save_tasks_to_file(), backfilled_day, repeat)
+
+    def undo_redo(tl):
+        while tl.journal.can_undo():
+            tl.undo()
+        while tl.journal.can_redo():
+            tl.redo()
+    results['undo_redo'] = measure(undo_redo, backfilled_day, repeat)
+
+    results['merge_touching_time_blocks'] = measure(
+        lambda task: task.merge_touching_time_blocks(),
+        lambda: overlapping_task(day, config['blocks'], config['overlap'], random.Random(config['seed'])),
+        repeat)
+
+    tl = generated_day()
+    known_params = [f"param {index}" for index in range(config['completions'])]
+    completer = AutoCompleter(['exit', 'rm ', 'stop', 'help', 'undo', 'redo'], known_params, fuzzy_limit=10)
+    completer.current_tasks = tl.tasks
+    completer.current_datetime = tl.current_datetime
+    inputs = ['', ' ', 'ta', 'task 1', 'task 1=', 'task 1=par', 'param 12', 'rm ta', 'prm', 'xyz']
+    def complete(state):
+        for text in inputs:
+            state = 0
+            while completer.complete(text, state) is not None:
+                state += 1
+    results['autocomplete'] = measure(complete, repeat=repeat)
+
+    def render(state):
+        renderer = ScreenRenderer(io.StringIO(), (120, 50))
+        timelogger.draw_day(renderer, tl)
+        timelogger.draw_day(renderer, tl, keep_cursor=True)
+    results['summary_render'] = measure(render, repeat=repeat)
+
+    day_count = write_history(history_directory, config['years'], config['history_tasks'], config['history_blocks'], rng)
+    def clear_cache():
+        cache = os.path.join(history_directory, 'summary_cache.json')
+        if os.path.exists(cache):
+            os.remove(cache)
+    results['report_uncached'] = measure(lambda state: timelogger.build_report(history_directory, use_cache=False), repeat=repeat)
+    results['report_cache_build'] = measure(lambda state: timelogger.build_report(history_directory), clear_cache, repeat)
+    results['report_cached'] = measure(lambda state: timelogger.build_report(history_directory), repeat=repeat)
+
+    # a save renaming a task of the last day, with the sidecars of all days in place
+    timelogger.SearchIndex(history_directory).refresh()
+    timelogger.Vocabulary.load_or_build(history_directory)
+    last_day_path = timelogger.find_day_files(history_directory)[-1][1]
+    renames = []
+    def renamed_day():
+        tl = TimeLogger(last_day_path)
+        renames.append(len(renames))
+        tl.command_create_rename_merge(f"0=renamed {renames[-1]}")
+        return tl
+    results['save_with_sidecars'] = measure(lambda tl: tl.save_tasks_to_file(), renamed_day, repeat)
+
+    today_directory = os.path.join(workdir, 'today')
+    write_day(today_directory, date.today(), synthetic_tasks(date.today(), config['tasks'], config['blocks'], rng))
+    results['status_startup'] = status_startup(today_directory, workdir, repeat)
+    return {'config': config, 'history_days': day_count, 'results': results}
+
+def compare(current, baseline, tolerance, noise_ms):
+    # names of the benchmarks slower than tolerance times their baseline, ignoring
+    # differences below noise_ms
+    regressions = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['min_ms']
+        after = result['min_ms']
+        if after > before * tolerance and after - before > noise_ms:
+            regressions.append(name)
+    return regressions
+
+def print_results(current, baseline):
+    for name, result in current['results'].items():
+        line = f"{name.ljust(28)} {result['min_ms']:10.2f}ms {result['median_ms']:10.2f}ms"
+        if baseline is not None and name in baseline['results']:
+            line += f"  x{result['min_ms'] / baseline['results'][name]['min_ms']:.2f}"
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark timelogger on synthetic days and histories')
+    parser.add_argument('--tasks', type=int, default=50, help='tasks of the large day')
+    parser.add_argument('--blocks', type=int, default=2000, help='blocks of the large day')
+    parser.add_argument('--overlap', type=float, default=0.5, help='share of overlapping blocks for the merge benchmark')
+    parser.add_argument('--commands', type=int, default=200, help='back-fill commands applied to the large day')
+    parser.add_argument('--completions', type=int, default=5000, help='known auto-completions')
+    parser.add_argument('--years', type=int, default=2, help='years of history in the report tree')
+    parser.add_argument('--history-tasks', dest='history_tasks', type=int, default=8, help='tasks per day of the history')
+    parser.add_argument('--history-blocks', dest='history_blocks', type=int, default=16, help='blocks per day of the history')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per benchmark')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='JSON file receiving the results')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON file with the baseline results')
+    parser.add_argument('--save-baseline', dest='save_baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed slowdown factor against the baseline')
+    parser.add_argument('--noise', type=float, default=1.0, help='slowdowns below this many milliseconds are ignored')
+    parser.add_argument('--status-budget', dest='status_budget', type=float, default=STATUS_BUDGET_MS, help='milliseconds allowed for timelogger_status.py')
+    options = parser.parse_args(argv)
+    config = {key: getattr(options, key) for key in ['tasks', 'blocks', 'overlap', 'commands', 'completions', 'years', 'history_tasks', 'history_blocks', 'repeat', 'seed']}
+
+    workdir = tempfile.mkdtemp(prefix='timelogger-bench-')
+    try:
+        current = run_benchmarks(config, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    with open(options.output, 'w') as file:
+        json.dump(current, file, indent=2)
+
+    baseline = None
+    status = 0
+    if not options.save_baseline:
+        if os.path.exists(options.baseline):
+            with open(options.baseline, 'r') as file:
+                baseline = json.load(file)
+            if baseline['config'] != config:
+                print(f"Baseline {options.baseline} was recorded with another configuration, not comparing")
+                baseline = None
+                status = 1
+        else:
+            print(f"No baseline in {options.baseline}, record one with --save-baseline")
+            status = 1
+    print_results(current, baseline)
+    startup = current['results']['status_startup']['min_ms']
+    if startup > options.status_budget:
+        print(f"timelogger_status.py took {startup:.1f}ms, over the budget of {options.status_budget:g}ms")
+        status = 1
+    if options.save_baseline:
+        with open(options.baseline, 'w') as file:
+            json.dump(current, file, indent=2)
+        print(f"Baseline stored in {options.baseline}")
+        return status
+    if baseline is not None:
+        regressions = compare(current, baseline, options.tolerance, options.noise)
+        if regressions:
+            print(f"Slower than {options.tolerance}x the baseline: {', '.join(regressions)}")
+            status = 1
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,16 +2,37 @@
 # watch "python3 -m unittest test_timelogger.py"
 
 import unittest
+import unittest.mock
+import asyncio
+import contextlib
+import io
 import json
 from datetime import datetime
+import random
 import re
 import os
 import shutil
+import time
+import timelogger
+import bench_timelogger
 from timelogger import AutoCompleter
+from timelogger import BlockIndex
+from timelogger import DayClock
+from timelogger import day_clock
+from timelogger import PrefixIndex
+from timelogger import live_loop
+from timelogger import ScreenRenderer
+from timelogger import SearchIndex
+from timelogger import SqliteStorage
 from timelogger import Task
 from timelogger import TimeBlock
 from timelogger import TimeConflict
 from timelogger import TimeLogger
+from timelogger import Vocabulary
+from timelogger import build_report
+from timelogger import find_day_files
+from timelogger import run_batch
+from timelogger import status_line
 
 
 test_date = datetime.strptime('2023-06-01', '%Y-%m-%d').timestamp()
@@ -22,6 +43,17 @@ def todays_datetime(h,m):
 def todays_timestamp(h,m):
     return datetime.fromtimestamp(test_date).replace(hour=h, minute=m, second=0, microsecond=0).timestamp()
 
+def is_directory_locked(directory):
+    # another open file description of the lock file cannot take the lock meanwhile
+    import fcntl
+    with open(os.path.join(directory, timelogger.LOCK_FILE_NAME), 'a') as file:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        return False
+
 # TODO cleanup variables
 today_datetime=todays_datetime(0,0)
 current_datetime=today_datetime
@@ -152,6 +184,249 @@ class TaskTimeBlock(unittest.TestCase):
         self.assertEqual(TimeBlock(current_datetime, 'now-20').time_spent(), 0)
 
 
+class TaskDayClock(unittest.TestCase):
+    def test_parse(self):
+        clock = day_clock(today_datetime.date())
+        for h in range(24):
+            for m in [0, 1, 15, 59]:
+                self.assertEqual(clock.parse(f"{h}:{m:02d}"), todays_timestamp(h, m))
+        self.assertEqual(clock.parse('7'), todays_timestamp(7, 0))
+        self.assertEqual(clock.parse('24'), None)
+        self.assertEqual(clock.parse('now'), None)
+
+    def test_format_blocks(self):
+        blocks = [TimeBlock(current_datetime, time_range) for time_range in ['9-17', '10:45-23:15', '9-now', '9-1']]
+        blocks.append(TimeBlock.from_timestamps(todays_timestamp(9, 0) + 24 * 3600, None))
+        formatted = day_clock(today_datetime.date()).format_blocks([block.start for block in blocks], [block.end for block in blocks], '-->')
+        self.assertEqual(formatted, [block.to_string('-->') for block in blocks])
+        self.assertEqual(formatted[:4], ['09:00-->17:00', '10:45-->23:15', '09:00-->now', 'Not Booked...'])
+        formatted = day_clock(today_datetime.date()).format_blocks([block.start for block in blocks[:2]], [block.end for block in blocks[:2]], ['-+>', '-->'])
+        self.assertEqual(formatted, ['09:00-+>17:00', '10:45-->23:15'])
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), 'needs time.tzset')
+    def test_parse_on_dst_switch(self):
+        previous_tz = os.environ.get('TZ')
+        def restore_tz():
+            if previous_tz is None:
+                os.environ.pop('TZ', None)
+            else:
+                os.environ['TZ'] = previous_tz
+            time.tzset()
+            day_clock.cache_clear()
+            DayClock.last = None
+        self.addCleanup(restore_tz)
+        os.environ['TZ'] = 'Europe/Berlin'
+        time.tzset()
+        day_clock.cache_clear()
+        switch_day = datetime(2023, 3, 26)
+        clock = day_clock(switch_day.date())
+        self.assertFalse(clock.regular_day)
+        self.assertEqual(clock.parse('12:30'), switch_day.replace(hour=12, minute=30).timestamp())
+
+class TaskStatus(unittest.TestCase):
+    def setUp(self):
+        self.tl = TimeLogger('./tmp/' + datetime.now().strftime("%Y-%m-%d_%A.json"))
+
+    def tearDown(self):
+        shutil.rmtree('./tmp/', ignore_errors=True)
+
+    def test_status_from_sidecar(self):
+        self.assertEqual(status_line('./tmp/'), 'No active task')
+        self.tl.command_create_rename_merge('working')
+        self.tl.save_tasks_to_file()
+        self.assertTrue(os.path.exists('./tmp/status.json'))
+        self.assertTrue(re.match(r'^working \d+m$', status_line('./tmp/')))
+        self.tl.command_stop()
+        self.tl.save_tasks_to_file()
+        self.assertEqual(status_line('./tmp/'), 'No active task')
+
+    def test_status_without_sidecar(self):
+        self.tl.command_create_rename_merge('working')
+        self.tl.save_tasks_to_file()
+        os.remove('./tmp/status.json')
+        self.assertTrue(status_line('./tmp/').startswith('working '))
+
+    @unittest.skipUnless(os.name == 'posix', 'needs fcntl')
+    def test_status_is_written_under_directory_lock(self):
+        write = timelogger.write_file_atomically
+        writes = []
+        def locked_write(filepath, raw):
+            if filepath.endswith(timelogger.STATUS_FILE_NAME):
+                writes.append(is_directory_locked('./tmp/'))
+            write(filepath, raw)
+        with unittest.mock.patch('timelogger.write_file_atomically', locked_write):
+            self.tl.command_create_rename_merge('working')
+            self.tl.save_tasks_to_file()
+        self.assertEqual(writes, [True])
+
+    def test_writers_use_own_temp_files(self):
+        # a temp file left behind, or one of another writer, is not touched
+        os.makedirs('./tmp/')
+        with open('./tmp/status.json.tmp', 'w') as file:
+            file.write('partial')
+        timelogger.write_file_atomically('./tmp/status.json', '{}')
+        with open('./tmp/status.json.tmp', 'r') as file:
+            self.assertEqual(file.read(), 'partial')
+        self.assertEqual(sorted(os.listdir('./tmp/')), ['status.json', 'status.json.tmp'])
+
+class TaskBatch(unittest.TestCase):
+    def setUp(self):
+        self.filepath = './tmp/2023-05-31_Wednesday.json'
+
+    def tearDown(self):
+        shutil.rmtree('./tmp/', ignore_errors=True)
+
+    def test_batch_saves_once(self):
+        tl = TimeLogger(self.filepath)
+        lines = ['# back-fill the morning'] + [f'task{hour % 3}={hour}-{hour}:30' for hour in range(8, 18)]
+        run_batch(tl, lines)
+        self.assertEqual(tl.save_stats['performed'], 1)
+        self.assertFalse(tl.is_dirty())
+        loaded = TimeLogger(self.filepath)
+        self.assertEqual([task.name for task in loaded.tasks], ['task2', 'task0', 'task1'])
+        self.assertEqual(loaded.get_summary()['total_hours'], 5)
+
+    def test_batch_ids_refer_to_normalized_tasks(self):
+        tl = TimeLogger(self.filepath)
+        run_batch(tl, ['b=10-11', 'a=9-10', 'rm 0', 'c=11-12', '1=d'])
+        self.assertEqual([task.name for task in tl.tasks], ['b', 'd'])
+
+    def test_batch_normalizes_once(self):
+        tl = TimeLogger(self.filepath)
+        normalize_tasks = tl.normalize_tasks
+        calls = []
+        def counted():
+            calls.append(len(tl.tasks))
+            normalize_tasks()
+        tl.normalize_tasks = counted
+        run_batch(tl, [f'task{hour % 3}={hour}-{hour}:30' for hour in range(8, 18)] + ['new task=18-19'])
+        self.assertEqual(len(calls), 1)
+        run_batch(tl, ['a=9:15-9:20', '0=b', 'c=10:15-10:20', 'd'])
+        self.assertEqual(len(calls), 3)
+
+    def test_batch_trace(self):
+        tl = TimeLogger(self.filepath)
+        os.makedirs('./tmp/')
+        timelogger.start_tracing('./tmp/trace.jsonl', profile_count=1)
+        try:
+            run_batch(tl, ['a=9-10', 'b=9:30-11', 'rm 0'])
+        finally:
+            timelogger.stop_tracing()
+        self.assertIsNone(timelogger.TRACER)
+        with open('./tmp/trace.jsonl', 'r') as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual([record['command'] for record in records], ['a=9-10', 'b=9:30-11', 'rm 0', '(batch save)'])
+        self.assertIn('conflicts', records[1]['phases'])
+        self.assertIn('normalize', records[2]['phases'])
+        self.assertEqual(records[2]['tasks'], 1)
+        self.assertEqual(records[2]['blocks'], 1)
+        self.assertGreater(records[3]['bytes_written'], 0)
+        self.assertTrue(os.path.exists('./tmp/trace.jsonl.slowest-1.prof'))
+        self.assertFalse(os.path.exists('./tmp/trace.jsonl.slowest-2.prof'))
+
+    def test_batch_day_switch_and_exit(self):
+        tl = TimeLogger(self.filepath)
+        run_batch(tl, ['a=9-10', '>', 'b=9-10', 'exit', 'c=10-11'])
+        self.assertEqual([task.name for task in TimeLogger(self.filepath).tasks], ['a'])
+        self.assertEqual([task.name for task in TimeLogger('./tmp/2023-06-01_Thursday.json').tasks], ['b'])
+
+class TaskScreenRenderer(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.renderer = ScreenRenderer(self.stream, (20, 10))
+
+    def written(self):
+        output = self.stream.getvalue()
+        self.stream.seek(0)
+        self.stream.truncate()
+        return output
+
+    def test_first_frame_clears_screen(self):
+        self.renderer.render(['header'], ['row'])
+        output = self.written()
+        self.assertTrue(output.startswith('\x1b[H\x1b[2J'))
+        self.assertIn('\x1b[1;1Hheader\x1b[K', output)
+        self.assertIn('\x1b[2;1Hrow\x1b[K', output)
+
+    def test_only_changed_lines_are_written(self):
+        self.renderer.render(['header'], ['a', 'b'])
+        self.written()
+        self.renderer.render(['header'], ['a', 'c'])
+        self.assertEqual(self.written(), '\x1b[3;1Hc\x1b[K\x1b[4;1H\x1b[J')
+        self.renderer.render(['header'], ['a', 'c'])
+        self.assertEqual(self.written(), '\x1b[4;1H\x1b[J')
+
+    def test_changed_cells_only(self):
+        self.renderer.render(['total 1h+5m'])
+        self.written()
+        self.renderer.render(['total 1h+6m'], keep_cursor=True)
+        self.assertEqual(self.written(), '\x1b7\x1b[1;10H6m\x1b[K\x1b8')
+        self.renderer.render(['total 1h+6m'], keep_cursor=True)
+        self.assertEqual(self.written(), '')
+        self.renderer.render(['total 1h+6m', 'new line'], keep_cursor=True)
+        self.assertEqual(self.written(), '')
+
+    def test_live_loop(self):
+        tl = TimeLogger('./tmp/2023-05-31_Wednesday.json')
+        commands = iter(['a=9-10', 'b=10-11', 'exit'])
+        def read_command():
+            time.sleep(0.02)
+            return next(commands)
+        renderer = ScreenRenderer(self.stream, (80, 30))
+        asyncio.run(live_loop(tl, read_command, renderer, interval=0.005))
+        shutil.rmtree('./tmp/', ignore_errors=True)
+        self.assertEqual([task.name for task in tl.tasks], ['a', 'b'])
+        self.assertIn('01 . ..1h+0m 10:00-->11:00 . . . b', renderer.previous)
+
+    def test_long_lines_are_cut(self):
+        self.renderer.render(['x' * 30])
+        self.assertEqual(self.renderer.previous, ['x' * 20])
+
+    def test_viewport_follows_focus(self):
+        rows = [f'row {index}' for index in range(20)]
+        frame = self.renderer.frame(['header'], rows, ['footer'], focus=15)
+        self.assertEqual(len(frame), 7)
+        self.assertIn('row 15', frame)
+        self.assertEqual(frame[0], 'header')
+        self.assertEqual(frame[-1], 'footer')
+        self.assertTrue(frame[-2].startswith('... '))
+        self.assertEqual(self.renderer.frame(['header'], rows[:3], ['footer']), ['header', 'row 0', 'row 1', 'row 2', 'footer'])
+
+class TaskBenchmark(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree('./tmp/', ignore_errors=True)
+
+    def test_small_run(self):
+        config = {'tasks': 3, 'blocks': 20, 'overlap': 0.5, 'commands': 5, 'completions': 10, 'years': 0,
+                  'history_tasks': 2, 'history_blocks': 3, 'repeat': 1, 'seed': 1}
+        current = bench_timelogger.run_benchmarks(config, './tmp/')
+        self.assertEqual(current['history_days'], 1)
+        self.assertIn('command_backfill', current['results'])
+        self.assertIn('status_startup', current['results'])
+        self.assertEqual(bench_timelogger.compare(current, current, 1.5, 1.0), [])
+
+    def test_run_fails_without_baseline(self):
+        argv = ['--tasks', '3', '--blocks', '20', '--commands', '5', '--completions', '10', '--years', '0',
+                '--repeat', '1', '--status-budget', '10000', '--output', './tmp/output.json', '--baseline', './tmp/baseline.json']
+        os.makedirs('./tmp/')
+        def run(extra_argv):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                status = bench_timelogger.main(argv + extra_argv)
+            return status, output.getvalue()
+        status, output = run([])
+        self.assertEqual(status, 1)
+        self.assertIn('No baseline in ./tmp/baseline.json', output)
+        self.assertEqual(run(['--save-baseline'])[0], 0)
+        self.assertTrue(os.path.exists('./tmp/baseline.json'))
+        self.assertEqual(run(['--tolerance', '1000', '--noise', '10000'])[0], 0)
+        self.assertEqual(run(['--seed', '2'])[0], 1)
+
+    def test_compare(self):
+        baseline = {'results': {'fast': {'min_ms': 1.0}, 'slow': {'min_ms': 10.0}, 'gone': {'min_ms': 1.0}}}
+        current = {'results': {'fast': {'min_ms': 1.9}, 'slow': {'min_ms': 20.0}, 'new': {'min_ms': 5.0}}}
+        self.assertEqual(bench_timelogger.compare(current, baseline, 1.5, 1.0), ['slow'])
+
 class TaskTask(unittest.TestCase):
     def setUp(self):
         self.task = Task("Test Task", current_datetime)
@@ -310,6 +585,84 @@ class TaskTask(unittest.TestCase):
         self.assertEqual(loaded_task.description, "Test description")
         self.assertEqual(len(loaded_task.time_blocks), 2)
 
+    def test_merge_touching_time_blocks(self):
+        for time_range in ['13-14', '9-10', '10-11', '10:30-12', '15-16', '15:30-now']:
+            self.task.time_blocks.append(TimeBlock(current_datetime, time_range))
+        self.assertTrue(self.task.has_mergeable_time_blocks())
+        self.task.merge_touching_time_blocks()
+        self.assertEqual([str(block) for block in self.task.time_blocks], ['09:00-12:00', '13:00-14:00', '15:00-now'])
+        self.assertFalse(self.task.has_mergeable_time_blocks())
+        self.assertTrue(self.task.is_active())
+
+    def test_insert_time_block_tells_touching_blocks(self):
+        self.assertFalse(self.task.insert_time_block(TimeBlock(current_datetime, '9-10')))
+        self.assertFalse(self.task.insert_time_block(TimeBlock(current_datetime, '13-14')))
+        self.assertFalse(self.task.insert_time_block(TimeBlock(current_datetime, '11-12')))
+        self.assertTrue(self.task.insert_time_block(TimeBlock(current_datetime, '10-10:30')))
+        self.assertTrue(self.task.insert_time_block(TimeBlock(current_datetime, '13:30-now')))
+        self.assertFalse(self.task.insert_time_block(TimeBlock(current_datetime, '15-16')))
+        self.assertTrue(self.task.has_mergeable_time_blocks())
+        self.task.merge_touching_time_blocks()
+        self.assertEqual([str(block) for block in self.task.time_blocks], ['09:00-10:30', '11:00-12:00', '15:00-16:00', '13:00-now'])
+
+    def test_merge_many_adjacent_time_blocks(self):
+        for minute in range(5000):
+            self.task.time_blocks.append(TimeBlock.from_timestamps(today + minute * 60, today + (minute + 1) * 60))
+        self.task.merge_touching_time_blocks()
+        self.assertEqual(len(self.task.time_blocks), 1)
+        self.assertEqual(self.task.get_last_end_time(), today + 5000 * 60)
+
+    def test_stop_after_midnight(self):
+        self.task.start(todays_timestamp(23, 0))
+        with unittest.mock.patch('time.time', return_value=todays_timestamp(23, 30)):
+            self.task.stop()
+        self.assertEqual(self.task.get_total_time_spent(), 0.5)
+        self.task.start(todays_timestamp(23, 45))
+        with unittest.mock.patch('time.time', return_value=todays_timestamp(3, 52) + 24 * 3600):
+            self.task.stop()
+        self.assertEqual(self.task.time_blocks[-1].end, today + 24 * 3600)
+        self.assertEqual(self.task.get_total_time_spent(), 0.75)
+
+    def test_start_keeps_later_blocks(self):
+        self.task.add_time_block('14-15')
+        self.task.start(todays_timestamp(10, 0))
+        self.assertTrue(self.task.is_active())
+        self.assertEqual(self.task.get_first_start_time(), todays_timestamp(10, 0))
+        self.task.merge_touching_time_blocks()
+        self.assertEqual([str(block) for block in self.task.time_blocks], ['14:00-15:00', '10:00-now'])
+        self.assertEqual(self.task.stop(todays_timestamp(10, 30)), todays_timestamp(10, 30))
+        self.assertFalse(self.task.is_active())
+        self.assertEqual([str(block) for block in self.task.time_blocks], ['10:00-10:30', '14:00-15:00'])
+
+    def test_start_inside_block(self):
+        self.task.add_time_block('9-11')
+        self.task.add_time_block('14-15')
+        self.task.start(todays_timestamp(10, 0))
+        self.assertTrue(self.task.has_mergeable_time_blocks())
+        self.task.merge_touching_time_blocks()
+        self.assertEqual([str(block) for block in self.task.time_blocks], ['14:00-15:00', '09:00-now'])
+        self.assertFalse(self.task.has_mergeable_time_blocks())
+
+    def test_compact_and_expand(self):
+        self.task.add_time_block('9-10')
+        self.task.add_time_block('11:30-12')
+        self.task.add_time_block('13-now')
+        expected = (self.task.get_total_time_spent(), self.task.get_task_time_range(), self.task.memento())
+        self.task.compact()
+        self.assertEqual(len(self.task.time_blocks), 3)
+        self.assertEqual(str(self.task.time_blocks[1]), '11:30-12:00')
+        self.assertTrue(self.task.is_active())
+        self.assertEqual(self.task.get_last_end_time(), None)
+        self.assertEqual(self.task.get_task_time_range(), expected[1])
+        self.assertTrue(abs(self.task.get_total_time_spent() - expected[0]) < 0.01)
+        self.task.time_blocks[-1].stop(todays_timestamp(14, 0))
+        self.assertFalse(self.task.is_active())
+        self.task.expand()
+        self.assertEqual(str(self.task.time_blocks[-1]), '13:00-14:00')
+        self.assertEqual(self.task.memento()[2][:2], expected[2][2][:2])
+        with self.assertRaises(AttributeError):
+            self.task.some_attribute = 1
+
     def test_get_first_start_time(self):
         self.task.add_time_block("3-4")
         self.task.add_time_block("1-2")
@@ -374,6 +727,18 @@ class TaskCommandTesks(unittest.TestCase):
         self.assertEqual(self.tl.current_datetime, today_datetime.date())
         shutil.rmtree('./tmp/')
 
+    def test_stop_on_past_day(self):
+        # the time of day now is before 23:59, the blocks must not end before they start
+        self.tl.command_create_rename_merge('a=23:59-now')
+        self.tl.command_stop()
+        block = self.tl.get_task('a').time_blocks[-1]
+        self.assertTrue(block.end >= block.start)
+        self.tl.command_create_rename_merge('b=23:59-now')
+        self.tl.command_create_rename_merge('a')
+        block = self.tl.get_task('b').time_blocks[-1]
+        self.assertTrue(block.end >= block.start)
+        self.assertTrue(self.tl.get_task('b').get_total_time_spent() >= 0)
+
     def test_command_next_day(self):
         self.tl.command_create_rename_merge('example')
         self.assertEqual(len(self.tl.tasks),1)
@@ -470,6 +835,14 @@ class TaskCommandTesks(unittest.TestCase):
         self.assertEqual(len(self.tl.get_task('task 1').time_blocks),1)
         self.assertEqual(self.tl.get_task('task 2'),None)
 
+    def test_merge_task_with_itself(self):
+        self.tl.command_create_rename_merge('a=9-10')
+        self.tl.command_create_rename_merge('b=10-11')
+        self.tl.command_create_rename_merge('a=a')
+        self.tl.command_create_rename_merge('a=0=b')
+        self.assertEqual([task.name for task in self.tl.tasks], ['a'])
+        self.assertEqual(self.tl.get_task('a').get_total_time_spent(), 2)
+
     def test_sub_command_rename(self):
         self.tl.command_create_rename_merge('old name')
         self.assertTrue(self.tl.get_task('old name') is not None)
@@ -478,6 +851,819 @@ class TaskCommandTesks(unittest.TestCase):
         self.assertTrue(self.tl.get_task('old name') is None)
         self.assertTrue(self.tl.get_task('new name') is not None)
 
+    def test_snapshot_uses_one_clock(self):
+        for command in ['a=8-9', 'b=9-10:30', '.lunch=12-13', 'a=13-14', 'b=15-now']:
+            self.tl.command_create_rename_merge(command)
+        now = self.tl.get_task('b').time_blocks[-1].start + 1800
+        snapshot = self.tl.snapshot(now)
+        rows = {row['name']: row for row in snapshot.rows}
+        self.assertEqual([row['id'] for row in snapshot.rows], list(range(len(self.tl.tasks))))
+        self.assertEqual(rows['a']['hours'], 2)
+        self.assertEqual(rows['b']['hours'], 2)
+        self.assertEqual(rows['a']['time_range'], self.tl.get_task('a').get_task_time_range())
+        self.assertEqual(rows['b']['time_range'], self.tl.get_task('b').get_task_time_range())
+        self.assertTrue(rows['b']['active'])
+        self.assertTrue(rows['.lunch']['unpaid'])
+        self.assertEqual(snapshot.total_hours, 5)
+        self.assertEqual(snapshot.working_hours, 4)
+        self.assertEqual(self.tl.get_summary(snapshot)['now'], now)
+
+    def test_percentage_lines(self):
+        self.assertEqual(self.tl.percentage_lines(self.tl.snapshot()), [])
+        for command in ['a=8-9', 'b=9-10', '.lunch=12-13']:
+            self.tl.command_create_rename_merge(command)
+        self.assertEqual(self.tl.percentage_lines(self.tl.snapshot()), ['a 50%; b 50%; '])
+        self.tl.command_create_rename_merge('c=10-11')
+        self.assertEqual(self.tl.percentage_lines(self.tl.snapshot()),
+                         ['a 33%; b 33%; c 34%; ', '', 'Percent correction on last task to ensure sum of 100%: 1%'])
+
+    def test_task_ids_follow_changes(self):
+        def assert_ids_match_tasks():
+            for index, task in enumerate(self.tl.tasks):
+                self.assertEqual(self.tl.find_task_id(task.name), index)
+                self.assertIs(self.tl.get_task(task.name), task)
+                self.assertEqual(self.tl.task_id_to_name(str(index)), task.name)
+        for command in ['c=12-13', 'b=10-11', 'a=8-9', 'a=b', 'c=renamed', 'd=7-8']:
+            self.tl.keep_history()
+            self.tl.command_create_rename_merge(command)
+            assert_ids_match_tasks()
+        self.assertEqual(self.tl.get_task('b'), None)
+        self.assertEqual(self.tl.get_task('c'), None)
+        self.tl.command_remove('rm 0')
+        assert_ids_match_tasks()
+        self.tl.undo()
+        self.tl.undo()
+        self.assertTrue(self.tl.task_exists('c'))
+        assert_ids_match_tasks()
+        self.tl.tasks = [Task('assigned', current_datetime)]
+        self.assertEqual(self.tl.find_task_id('assigned'), 0)
+
+class TaskEventLog(unittest.TestCase):
+    def setUp(self):
+        self.filepath = './tmp/' + today_datetime.strftime("%Y-%m-%d_%A.json")
+        self.tl = TimeLogger(self.filepath)
+
+    def tearDown(self):
+        shutil.rmtree('./tmp/', ignore_errors=True)
+
+    def run_commands(self, commands):
+        for command in commands:
+            if command == 'undo':
+                self.tl.undo()
+            elif command == 'redo':
+                self.tl.redo()
+            elif command.startswith('rm '):
+                self.tl.keep_history()
+                self.tl.command_remove(command)
+            elif command == 'stop':
+                self.tl.keep_history()
+                self.tl.command_stop()
+            else:
+                self.tl.keep_history()
+                self.tl.command_create_rename_merge(command)
+            self.tl.save_tasks_to_file()
+
+    def assert_reloaded_equal(self):
+        reloaded = TimeLogger(self.filepath)
+        self.assertEqual([task.memento() for task in reloaded.tasks], [task.memento() for task in self.tl.tasks])
+
+    def test_random_sessions_replay_to_same_state(self):
+        rng = random.Random(7)
+        names = ['a', 'b', 'c', 'x']
+        for session in range(60):
+            shutil.rmtree('./tmp/', ignore_errors=True)
+            self.tl = TimeLogger(self.filepath)
+            commands = ['a=0-1', 'x=1:30-2', 'b', f'c={rng.randint(2, 22)}-now']
+            for _ in range(rng.randint(0, 8)):
+                start = rng.randint(0, 22 * 4)
+                end = rng.randint(start + 1, 23 * 4)
+                commands.append(rng.choice([
+                    f"{rng.choice(names)}={start // 4}:{start % 4 * 15:02d}-{end // 4}:{end % 4 * 15:02d}",
+                    f"{rng.choice(names)}={start // 4}:{start % 4 * 15:02d}-now",
+                    rng.choice(names), 'stop', f"rm {rng.choice(names)}", f"{rng.choice(names)}={rng.choice(names)}",
+                    'undo', 'redo']))
+            self.run_commands(commands)
+            self.assertLessEqual(len([task for task in self.tl.tasks if task.is_active()]), 1)
+            self.assert_reloaded_equal()
+            # undo takes back every command exactly, redo repeats them
+            final = [task.memento() for task in self.tl.tasks]
+            undone = len(self.tl.journal.history)
+            self.run_commands(['undo'] * undone)
+            self.assertEqual(self.tl.tasks, [])
+            self.assert_reloaded_equal()
+            self.run_commands(['redo'] * undone)
+            self.assertEqual([task.memento() for task in self.tl.tasks], final)
+            self.assert_reloaded_equal()
+
+    def test_commands_are_appended_to_log(self):
+        self.run_commands(['first'])
+        snapshot = open(self.filepath).read()
+        self.run_commands(['a=9-12', 'b=10-11', 'c', 'stop', 'a=b', 'a=renamed', 'd=13-14', 'rm d'])
+        self.assertEqual(open(self.filepath).read(), snapshot)
+        self.assertTrue(os.path.exists(self.tl.log_filepath))
+        self.assert_reloaded_equal()
+
+    def test_undo_is_logged_and_compaction_writes_snapshot(self):
+        self.run_commands(['a=9-12', 'b=10-11'])
+        self.tl.undo()
+        self.tl.save_tasks_to_file()
+        with open(self.tl.log_filepath, 'r') as file:
+            self.assertIn('restore', [json.loads(line).get('op') for line in file])
+        self.assert_reloaded_equal()
+        self.tl.redo()
+        self.tl.save_tasks_to_file()
+        self.assert_reloaded_equal()
+        self.tl.log_size = 10**9
+        self.run_commands(['c=13-14'])
+        self.assertFalse(os.path.exists(self.tl.log_filepath))
+        self.assert_reloaded_equal()
+
+    def test_day_file_v2_decodes_blocks_lazily(self):
+        self.run_commands(['a=9-10', 'a=11-12', 'b=13-14', 'c'])
+        self.tl.write_snapshot()
+        with open(self.filepath, 'r') as file:
+            self.assertEqual(json.load(file)['version'], 2)
+        reloaded = TimeLogger(self.filepath)
+        self.assertFalse(any(task.is_decoded() for task in reloaded.tasks))
+        self.assertEqual([task.get_task_time_range() for task in reloaded.tasks], [task.get_task_time_range() for task in self.tl.tasks])
+        self.assertEqual({task.name: task.is_active() for task in reloaded.tasks}, {'a': False, 'b': False, 'c': True})
+        self.assertEqual(reloaded.get_task('a').get_total_time_spent(), 2)
+        self.assertFalse(any(task.is_decoded() for task in reloaded.tasks))
+        reloaded.write_snapshot()
+        self.assertFalse(any(task.is_decoded() for task in reloaded.tasks))
+        self.assert_reloaded_equal()
+        self.assertEqual([str(block) for block in reloaded.get_task('a').time_blocks], ['09:00-10:00', '11:00-12:00'])
+
+    def test_day_file_v1_is_migrated_on_write(self):
+        os.makedirs('./tmp/')
+        tasks = [Task('a', current_datetime), Task('b', current_datetime)]
+        tasks[0].add_time_block('9-10')
+        tasks[1].add_time_block('10-now')
+        with open(self.filepath, 'w') as file:
+            json.dump([task.get_json() for task in tasks], file)
+        self.tl = TimeLogger(self.filepath)
+        self.assertEqual([task.memento() for task in self.tl.tasks], [task.memento() for task in tasks])
+        self.run_commands(['c=11-12'])
+        with open(self.filepath, 'r') as file:
+            self.assertEqual(json.load(file)['version'], 2)
+        self.assert_reloaded_equal()
+
+    def test_unchanged_state_is_not_written(self):
+        self.tl.save_tasks_to_file()
+        self.assertFalse(os.path.exists(self.filepath))
+        self.run_commands(['a=9-12'])
+        self.tl.undo()
+        self.tl.save_tasks_to_file()
+        self.tl.undo()
+        self.tl.save_tasks_to_file()
+        self.tl.command_next_day()
+        self.tl.save_tasks_to_file()
+        self.assertEqual(self.tl.save_stats, {'performed': 2, 'skipped': 3})
+        self.assertEqual([name for name in os.listdir('./tmp/') if name.endswith('.tmp')], [])
+
+    def test_commands_changing_nothing_are_not_written(self):
+        self.run_commands(['a=9-10', 'b'])
+        self.tl.save_tasks_to_file()
+        with open(self.filepath + '.log', 'r') as file:
+            log = file.read()
+        self.run_commands(['x=y=z', 'b', str(self.tl.find_task_id('b')), 'a=a'])
+        self.tl.save_tasks_to_file()
+        self.assertEqual(self.tl.save_stats, {'performed': 2, 'skipped': 6})
+        with open(self.filepath + '.log', 'r') as file:
+            self.assertEqual(file.read(), log)
+
+    def test_stale_and_torn_logs(self):
+        self.run_commands(['a=9-12', 'b=10-11'])
+        with open(self.tl.log_filepath, 'a') as file:
+            file.write('{"op": "remo')
+        self.assert_reloaded_equal()
+        stale_log = open(self.tl.log_filepath).read()
+        self.tl.write_snapshot()
+        with open(self.tl.log_filepath, 'w') as file:
+            file.write(stale_log)
+        self.assert_reloaded_equal()
+
+class TaskConcurrentUse(unittest.TestCase):
+    def setUp(self):
+        self.filepath = './tmp/2023-05-31_Wednesday.json'
+        self.first = TimeLogger(self.filepath)
+        self.second = TimeLogger(self.filepath)
+
+    def tearDown(self):
+        shutil.rmtree('./tmp/', ignore_errors=True)
+
+    def run_command(self, tl, command):
+        tl.keep_history()
+        tl.command_create_rename_merge(command)
+        tl.save_tasks_to_file()
+
+    def test_saves_are_rebased(self):
+        self.run_command(self.first, 'a=9-10')
+        self.run_command(self.second, 'b=10-11')
+        self.run_command(self.first, 'c=11-12')
+        self.run_command(self.second, 'a=12-13')
+        reloaded = TimeLogger(self.filepath)
+        self.assertEqual([task.memento() for task in reloaded.tasks], [task.memento() for task in self.second.tasks])
+        self.assertEqual({task.name: task.block_count() for task in reloaded.tasks}, {'a': 2, 'b': 1, 'c': 1})
+
+    def test_one_active_task_after_rebase(self):
+        self.run_command(self.first, 'x=1-now')
+        self.run_command(self.second, 'y')
+        reloaded = TimeLogger(self.filepath)
+        self.assertEqual([task.name for task in reloaded.tasks if task.is_active()], ['y'])
+
+    def test_rebased_merge_keeps_blocks_of_other_process(self):
+        self.run_command(self.first, 'a=9-10')
+        self.run_command(self.first, 'b=10:30-11')
+        self.second.reload_if_changed()
+        self.run_command(self.second, 'a=14-15')
+        self.run_command(self.first, 'a=b')
+        for tl in [self.first, TimeLogger(self.filepath)]:
+            self.assertEqual([task.name for task in tl.tasks], ['a'])
+            self.assertEqual([str(block) for block in tl.get_task('a').time_blocks], ['09:00-10:00', '10:30-11:00', '14:00-15:00'])
+
+    def test_undo_after_rebase(self):
+        self.run_command(self.first, 'a=1-2')
+        self.run_command(self.second, 'b=3-4')
+        self.run_command(self.first, 'c=5-6')
+        self.first.undo()
+        self.first.save_tasks_to_file()
+        self.assertEqual(sorted(task.name for task in TimeLogger(self.filepath).tasks), ['a', 'b'])
+        self.assertEqual(self.first.pop_conflicts(), [])
+
+    def test_undo_keeps_blocks_of_other_process(self):
+        self.run_command(self.first, 'a=9-10')
+        self.second.reload_if_changed()
+        self.run_command(self.second, 'a=14-15')
+        self.first.undo()
+        self.first.save_tasks_to_file()
+        for tl in [self.first, TimeLogger(self.filepath)]:
+            self.assertEqual([str(block) for block in tl.get_task('a').time_blocks], ['14:00-15:00'])
+        self.assertEqual(self.first.pop_conflicts(), ["'a' was kept, another process added blocks to it"])
+        self.first.redo()
+        self.first.save_tasks_to_file()
+        self.assertEqual([str(block) for block in TimeLogger(self.filepath).get_task('a').time_blocks], ['09:00-10:00', '14:00-15:00'])
+
+    def test_journal_is_kept_on_reload(self):
+        self.run_command(self.first, 'a=9-10')
+        self.run_command(self.first, 'a=renamed')
+        self.run_command(self.second, 'b=10-11')
+        self.assertTrue(self.first.reload_if_changed())
+        self.first.undo()
+        self.first.save_tasks_to_file()
+        self.assertEqual(sorted(task.name for task in TimeLogger(self.filepath).tasks), ['a', 'b'])
+
+    def test_conflicts_are_drawn(self):
+        self.run_command(self.first, 'a=9-10')
+        self.second.reload_if_changed()
+        self.run_command(self.second, 'b=9:30-11')
+        stream = io.StringIO()
+        messages = timelogger.run_and_draw(self.first, ScreenRenderer(stream, (100, 30)), 'undo')
+        self.assertEqual(messages, ["'a': 1 block(s) changed by another process were kept"])
+        self.assertIn(messages[0], stream.getvalue())
+        self.assertEqual([str(block) for block in TimeLogger(self.filepath).get_task('a').time_blocks], ['09:00-09:30'])
+
+    def test_one_lock_file_per_directory(self):
+        self.run_command(self.first, 'a=9-10')
+        self.first.command_next_day()
+        self.run_command(self.first, 'b=9-10')
+        self.assertEqual(sorted(name for name in os.listdir('./tmp/') if 'lock' in name), ['timelogger.lock'])
+
+    def test_reload_if_changed(self):
+        self.assertFalse(self.second.reload_if_changed())
+        self.run_command(self.first, 'a=9-10')
+        self.assertTrue(self.second.reload_if_changed())
+        self.assertEqual([task.name for task in self.second.tasks], ['a'])
+        self.assertFalse(self.second.reload_if_changed())
+
+class TaskSqliteStorage(unittest.TestCase):
+    def setUp(self):
+        self.storage = SqliteStorage('./tmp/timelogger.sqlite3')
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree('./tmp/', ignore_errors=True)
+
+    def run_commands(self, tl, commands):
+        for command in commands:
+            tl.keep_history()
+            tl.command_create_rename_merge(command)
+            tl.save_tasks_to_file()
+
+    def test_days_round_trip(self):
+        tl = TimeLogger('./tmp/2023-05-31_Wednesday.json', self.storage)
+        self.run_commands(tl, ['a=9-10', 'b=10-11', 'a=12-now', 'b=described'])
+        self.assertFalse(os.path.exists('./tmp/2023-05-31_Wednesday.json'))
+        tl.command_next_day()
+        self.run_commands(tl, ['c=9-10'])
+        reloaded = TimeLogger('./tmp/2023-05-31_Wednesday.json', self.storage)
+        tl.command_prev_day()
+        self.assertEqual([task.memento() for task in reloaded.tasks], [task.memento() for task in tl.tasks])
+        self.assertEqual([task.name for task in tl.tasks], ['a', 'described'])
+        self.assertTrue(tl.get_task('a').is_active())
+        self.assertEqual([day.isoformat() for day in self.storage.days()], ['2023-05-31', '2023-06-01'])
+
+    def test_import_and_queries(self):
+        for path, commands in [('./tmp/json/2023-05-30_Tuesday.json', ['a=9-10', 'b=14-15']),
+                               ('./tmp/json/2023-05-31_Wednesday.json', ['a=11-12', 'c=14-16'])]:
+            self.run_commands(TimeLogger(path), commands)
+        self.assertEqual(self.storage.import_json_tree('./tmp/json/'), 2)
+        blocks = self.storage.blocks_of_task('a')
+        self.assertEqual([(day.isoformat(), (end - start) / 3600) for day, start, end in blocks], [('2023-05-30', 1), ('2023-05-31', 1)])
+        self.assertEqual(len(self.storage.blocks_of_task('a', first_day=datetime(2023, 5, 31).date())), 1)
+        tuesday_afternoon = datetime(2023, 5, 30, 14, 30).timestamp()
+        self.assertEqual(self.storage.tasks_at(tuesday_afternoon), ['b'])
+        self.assertEqual(self.storage.tasks_at(tuesday_afternoon + 24 * 3600), ['c'])
+        self.assertEqual(self.storage.tasks_at(tuesday_afternoon + 3600), [])
+
+    def test_concurrent_saves_are_rebased(self):
+        other_storage = SqliteStorage('./tmp/timelogger.sqlite3')
+        tl = TimeLogger('./tmp/2023-05-31_Wednesday.json', self.storage)
+        other = TimeLogger('./tmp/2023-05-31_Wednesday.json', other_storage)
+        self.run_commands(tl, ['a=9-10'])
+        self.run_commands(other, ['b=10-11'])
+        self.assertEqual([task.name for task in other.tasks], ['a', 'b'])
+        self.run_commands(tl, ['a=11-12'])
+        other_storage.close()
+        reloaded = TimeLogger('./tmp/2023-05-31_Wednesday.json', self.storage)
+        self.assertEqual([(task.name, [str(block) for block in task.time_blocks]) for task in reloaded.tasks],
+                         [('a', ['09:00-10:00', '11:00-12:00']), ('b', ['10:00-11:00'])])
+        self.assertEqual([task.memento() for task in reloaded.tasks], [task.memento() for task in tl.tasks])
+
+    def test_vocabulary_of_storage(self):
+        tl = TimeLogger('./tmp/2023-05-31_Wednesday.json', self.storage)
+        self.run_commands(tl, ['a=9-10', 'b=10-11'])
+        tl.command_next_day()
+        self.run_commands(tl, ['b=9-10'])
+        self.assertEqual(Vocabulary.load_or_build('./tmp/', self.storage).ranked(), ['b', 'a'])
+        self.assertFalse(os.path.exists('./tmp/' + Vocabulary.FILE_NAME))
+
+class TaskExport(unittest.TestCase):
+    def setUp(self):
+        for path, commands in [('./tmp/2023-05-30_Tuesday.json', ['a=9-10', '.lunch=12-13']),
+                               ('./tmp/2023-05-31_Wednesday.json', ['a=11-12', 'b, c=14-now'])]:
+            tl = TimeLogger(path)
+            for command in commands:
+                tl.command_create_rename_merge(command)
+            tl.save_tasks_to_file()
+        self.now = datetime(2023, 5, 31, 15, 30).timestamp()
+
+    def tearDown(self):
+        shutil.rmtree('./tmp/', ignore_errors=True)
+
+    def export(self, export_format, open_blocks='keep', first_day=None):
+        stream = io.StringIO()
+        timelogger.export_days(timelogger.iter_days('./tmp/', first_day), export_format, stream, open_blocks, self.now)
+        return stream.getvalue()
+
+    def test_csv(self):
+        lines = self.export('csv').splitlines()
+        self.assertEqual(lines[0], 'date,task,description,unpaid,start,end,hours,open')
+        self.assertEqual(lines[1], '2023-05-30,a,,False,2023-05-30T09:00:00,2023-05-30T10:00:00,1.0,False')
+        self.assertEqual(lines[2], '2023-05-30,.lunch,,True,2023-05-30T12:00:00,2023-05-30T13:00:00,1.0,False')
+        self.assertEqual(lines[4], '2023-05-31,"b, c",,False,2023-05-31T14:00:00,,,True')
+        self.assertEqual(len(self.export('csv', first_day=datetime(2023, 5, 31).date()).splitlines()), 3)
+
+    def test_jsonl_open_blocks(self):
+        rows = [json.loads(line) for line in self.export('jsonl', 'now').splitlines()]
+        self.assertEqual(rows[-1]['end'], '2023-05-31T15:30:00')
+        self.assertEqual(rows[-1]['hours'], 1.5)
+        self.assertTrue(rows[-1]['open'])
+        self.assertEqual(len(self.export('jsonl', 'skip').splitlines()), 3)
+
+    def test_ics(self):
+        output = self.export('ics')
+        self.assertTrue(output.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertEqual(output.count('BEGIN:VEVENT'), 4)
+        self.assertEqual(output.count('DTEND:'), 3)
+        self.assertIn('SUMMARY:b\\, c\r\n', output)
+        self.assertIn('CATEGORIES:unpaid\r\n', output)
+        self.assertTrue(all(len(line) <= 75 for line in output.split('\r\n')))
+
+    def test_ics_folds_octets(self):
+        # RFC 5545 limits lines to 75 octets, multibyte characters count with each byte
+        name = 'Überprüfung der Änderungen für größere Kunden ' * 3
+        tl = TimeLogger('./tmp/2023-06-01_Thursday.json')
+        tl.command_create_rename_merge(name.strip() + '=9-10')
+        tl.save_tasks_to_file()
+        output = self.export('ics', first_day=datetime(2023, 6, 1).date())
+        lines = output.split('\r\n')
+        self.assertTrue(all(len(line.encode()) <= 75 for line in lines))
+        self.assertIn('SUMMARY:' + name.strip() + '\r\n', output.replace('\r\n ', ''))
+
+class TaskSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.run_commands('./tmp/2023-05-30_Tuesday.json', ['Review PR=9-10', 'deploy=10-11:30'])
+        self.run_commands('./tmp/2023-05-31_Wednesday.json', ['review docs=9-9:30', '.lunch=12-13'])
+
+    def tearDown(self):
+        shutil.rmtree('./tmp/', ignore_errors=True)
+
+    def run_commands(self, path, commands):
+        tl = TimeLogger(path)
+        for command in commands:
+            tl.command_create_rename_merge(command)
+        tl.save_tasks_to_file()
+        return tl
+
+    def test_queries(self):
+        index = SearchIndex('./tmp/')
+        index.refresh()
+        self.assertEqual(index.find('rev'), [('2023-05-31', 'review docs'), ('2023-05-30', 'Review PR')])
+        self.assertEqual(index.find('rev p'), [('2023-05-30', 'Review PR')])
+        self.assertEqual(index.find('ew d', 'substring'), [('2023-05-31', 'review docs')])
+        self.assertEqual(index.find('^(deploy|.lunch)$', 'regex'), [('2023-05-31', '.lunch'), ('2023-05-30', 'deploy')])
+        days = index.search('review')
+        self.assertEqual([(day['date'], day['hours']) for day in days], [('2023-05-31', 0.5), ('2023-05-30', 1)])
+
+    def test_saves_update_index(self):
+        self.run_commands('./tmp/2023-06-01_Thursday.json', ['deploy=9-10'])
+        self.assertFalse(os.path.exists('./tmp/search_index.json'))
+        SearchIndex('./tmp/').refresh()
+        self.run_commands('./tmp/2023-06-02_Friday.json', ['hotfix=9-10'])
+        self.run_commands('./tmp/2023-05-30_Tuesday.json', ['deploy=release'])
+        index = SearchIndex('./tmp/')
+        self.assertEqual(index.find('hot'), [('2023-06-02', 'hotfix')])
+        self.assertEqual(index.find('deploy'), [('2023-06-01', 'deploy')])
+        self.assertEqual(index.find('release'), [('2023-05-30', 'release')])
+
+    @unittest.skipUnless(os.name == 'posix', 'needs fcntl')
+    def test_index_is_written_under_directory_lock(self):
+        SearchIndex('./tmp/').refresh()
+        append = timelogger.append_to_sidecar_log
+        appends = []
+        def locked_append(filepath, update):
+            appends.append(is_directory_locked('./tmp/'))
+            return append(filepath, update)
+        with unittest.mock.patch('timelogger.append_to_sidecar_log', locked_append):
+            self.run_commands('./tmp/2023-06-02_Friday.json', ['hotfix=9-10'])
+        self.assertEqual(appends, [True])
+
+    def test_saves_append_their_day(self):
+        SearchIndex('./tmp/').refresh()
+        stat = os.stat('./tmp/search_index.json')
+        self.run_commands('./tmp/2023-06-02_Friday.json', ['hotfix=9-10'])
+        self.run_commands('./tmp/2023-05-30_Tuesday.json', ['deploy=release'])
+        self.assertEqual(os.stat('./tmp/search_index.json').st_ino, stat.st_ino)
+        with open('./tmp/search_index.json.log', 'r') as file:
+            self.assertEqual([json.loads(line)['day'] for line in file], ['2023-06-02', '2023-05-30'])
+        # a search with nothing to add keeps the log
+        index = SearchIndex('./tmp/')
+        index.refresh()
+        self.assertEqual(index.find('release'), [('2023-05-30', 'release')])
+        self.assertTrue(os.path.exists('./tmp/search_index.json.log'))
+        SearchIndex('./tmp/').refresh(rebuild=True)
+        self.assertFalse(os.path.exists('./tmp/search_index.json.log'))
+        self.assertEqual(SearchIndex('./tmp/').find('release'), [('2023-05-30', 'release')])
+
+    def test_large_log_is_compacted(self):
+        SearchIndex('./tmp/').refresh()
+        with unittest.mock.patch('timelogger.LOG_COMPACTION_THRESHOLD', 100):
+            tl = self.run_commands('./tmp/2023-06-02_Friday.json', ['hotfix=9-10'])
+            self.assertTrue(os.path.exists('./tmp/search_index.json.log'))
+            tl.command_create_rename_merge('a long description of the fix=10-11')
+            tl.save_tasks_to_file()
+        self.assertFalse(os.path.exists('./tmp/search_index.json.log'))
+        with open('./tmp/search_index.json', 'r') as file:
+            self.assertIn('2023-06-02', json.load(file)['days'])
+        self.assertEqual(SearchIndex('./tmp/').find('fix'), [('2023-06-02', 'a long description of the fix')])
+
+    def test_log_left_behind_by_compaction(self):
+        # a crash after the snapshot was written leaves the log it took in
+        SearchIndex('./tmp/').refresh()
+        self.run_commands('./tmp/2023-06-02_Friday.json', ['hotfix=9-10'])
+        shutil.copy('./tmp/search_index.json.log', './tmp/log')
+        SearchIndex('./tmp/').refresh(rebuild=True)
+        os.rename('./tmp/log', './tmp/search_index.json.log')
+        index = SearchIndex('./tmp/')
+        self.assertEqual(index.find('hot'), [('2023-06-02', 'hotfix')])
+        self.assertEqual(index.tokens['hotfix'], [['2023-06-02', 'hotfix']])
+
+class TaskDayCache(unittest.TestCase):
+    def setUp(self):
+        self.tl = TimeLogger('./tmp/2023-05-31_Wednesday.json')
+
+    def tearDown(self):
+        shutil.rmtree('./tmp/', ignore_errors=True)
+
+    def run_command(self, command):
+        self.tl.keep_history()
+        self.tl.command_create_rename_merge(command)
+
+    def test_days_keep_undo_and_unsaved_changes(self):
+        self.run_command('a=9-10')
+        self.tl.command_next_day()
+        self.run_command('b=9-10')
+        self.tl.command_prev_day()
+        self.assertEqual([task.name for task in self.tl.tasks], ['a'])
+        self.assertTrue(self.tl.is_dirty())
+        self.tl.undo()
+        self.assertEqual(self.tl.tasks, [])
+        self.tl.command_next_day()
+        self.assertEqual([task.name for task in self.tl.tasks], ['b'])
+        self.tl.undo()
+        self.assertEqual(self.tl.tasks, [])
+        self.assertFalse(os.path.exists('./tmp/'))
+
+    def test_prefetched_neighbours(self):
+        for path, command in [('./tmp/2023-05-30_Tuesday.json', 'before=9-10'), ('./tmp/2023-06-01_Thursday.json', 'after=9-10')]:
+            tl = TimeLogger(path)
+            tl.command_create_rename_merge(command)
+            tl.save_tasks_to_file()
+        self.tl.prefetch_neighbours().join()
+        self.tl.command_next_day()
+        self.assertEqual([task.name for task in self.tl.tasks], ['after'])
+        self.assertEqual(self.tl.day_cache.hits, 1)
+
+    def test_changed_day_is_reloaded(self):
+        self.tl.command_next_day()
+        self.tl.command_prev_day()
+        other = TimeLogger('./tmp/2023-06-01_Thursday.json')
+        other.command_create_rename_merge('other=9-10')
+        other.save_tasks_to_file()
+        self.tl.command_next_day()
+        self.assertEqual([task.name for task in self.tl.tasks], ['other'])
+
+    def test_evicted_unsaved_days_are_saved(self):
+        self.tl.day_cache = timelogger.DayCache(size=1)
+        self.run_command('a=9-10')
+        self.tl.command_next_day()
+        self.run_command('b=9-10')
+        self.tl.command_next_day()
+        self.assertEqual([task.name for task in TimeLogger('./tmp/2023-05-31_Wednesday.json').tasks], ['a'])
+
+class TaskBlockIndex(unittest.TestCase):
+    def test_overlapping(self):
+        a = Task('a', current_datetime)
+        a.add_time_block('8-9')
+        a.add_time_block('12-13')
+        b = Task('b', current_datetime)
+        b.add_time_block('9-12')
+        b.add_time_block('14-now')
+        index = BlockIndex([a, b])
+        names = lambda found: sorted(f"{task.name}:{block}" for block, task in found)
+        self.assertEqual(names(index.overlapping(todays_timestamp(9, 0), todays_timestamp(12, 0))), ['b:09:00-12:00'])
+        self.assertEqual(names(index.overlapping(todays_timestamp(8, 30), todays_timestamp(12, 30))), ['a:08:00-09:00', 'a:12:00-13:00', 'b:09:00-12:00'])
+        self.assertEqual(names(index.overlapping(todays_timestamp(13, 0), todays_timestamp(14, 0))), [])
+        self.assertEqual(names(index.overlapping(todays_timestamp(15, 0), None)), ['b:14:00-now'])
+        index.discard(b.time_blocks[0])
+        self.assertEqual(names(index.overlapping(todays_timestamp(9, 0), todays_timestamp(12, 0))), [])
+
+    def test_random_time_blocks_never_overlap(self):
+        tl = TimeLogger('./tmp/' + today_datetime.strftime("%Y-%m-%d_%A.json"))
+        tl.tasks = []
+        rng = random.Random(4)
+        for _ in range(300):
+            start = rng.randint(0, 22 * 4)
+            end = rng.randint(start + 1, 23 * 4)
+            time_range = f"{start // 4}:{start % 4 * 15:02d}-{end // 4}:{end % 4 * 15:02d}"
+            tl.command_create_rename_merge(f"task {rng.randint(0, 9)}={time_range}")
+            blocks = sorted(block for task in tl.tasks for block in task.time_blocks)
+            for previous, block in zip(blocks, blocks[1:]):
+                self.assertTrue(previous.end <= block.start)
+        self.assertTrue(abs(sum(task.get_total_time_spent() for task in tl.tasks) - sum(block.time_spent() for block in blocks)) < 1e-9)
+
+    def test_index_survives_back_fills(self):
+        tl = TimeLogger('./tmp/' + today_datetime.strftime("%Y-%m-%d_%A.json"))
+        tl.tasks = []
+        tl.command_create_rename_merge('c=7-8')
+        index = tl.get_block_index()
+        # touching, splitting and reordering back-fills, merged by the normalization
+        for command in ['a=9-10', 'a=10-11', 'b=9:30-10:30', 'a=8-9', 'b=6-7', 'c=11-12', 'a=12-13', 'b=13-14', 'c=14-15', 'a=15-now']:
+            tl.command_create_rename_merge(command)
+            self.assertIs(tl.get_block_index(), index)
+        fresh = BlockIndex(tl.tasks)
+        entries = lambda index: [(block.start, block.end, task.name) for block, task in index.entries + index.open_entries]
+        self.assertEqual(entries(index), entries(fresh))
+        self.assertEqual(index.starts, fresh.starts)
+
+class TaskReport(unittest.TestCase):
+    def setUp(self):
+        for day, commands in [('2023-05-31', ['a=9-11', '.lunch=12-13']), ('2023-06-01', ['a=9-10', 'b=10-14']), ('2023-06-05', ['b=8-9'])]:
+            tl = TimeLogger('./tmp/' + datetime.strptime(day, '%Y-%m-%d').strftime("%Y-%m-%d_%A.json"))
+            for command in commands:
+                tl.command_create_rename_merge(command)
+            tl.save_tasks_to_file()
+        open('./tmp/auto_complete.csv', 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree('./tmp/', ignore_errors=True)
+
+    def test_find_day_files(self):
+        self.assertEqual(len(find_day_files('./tmp/')), 3)
+        first_day = datetime.strptime('2023-06-01', '%Y-%m-%d').date()
+        self.assertEqual([day.isoformat() for day, path in find_day_files('./tmp/', first_day)], ['2023-06-01', '2023-06-05'])
+
+    def test_build_report(self):
+        pool_threshold = timelogger.REPORT_POOL_THRESHOLD
+        self.addCleanup(setattr, timelogger, 'REPORT_POOL_THRESHOLD', pool_threshold)
+        timelogger.REPORT_POOL_THRESHOLD = 0
+        for processes in [1, 2]:
+            report = build_report('./tmp/', processes=processes)
+            self.assertEqual(report['totals'], {'total': 9, 'paid': 8, 'unpaid': 1})
+            self.assertEqual(report['tasks'], {'a': 3, '.lunch': 1, 'b': 5})
+            self.assertEqual(report['days']['2023-06-01'], {'total': 5, 'paid': 5, 'unpaid': 0})
+            self.assertEqual(report['weeks']['2023-W22']['total'], 8)
+            self.assertEqual(report['weeks']['2023-W23']['total'], 1)
+            self.assertEqual(report['months'], {'2023-05': {'total': 3, 'paid': 2, 'unpaid': 1}, '2023-06': {'total': 6, 'paid': 6, 'unpaid': 0}})
+
+    def test_iter_days(self):
+        history = list(timelogger.iter_days('./tmp/'))
+        self.assertEqual([day.isoformat() for day, tasks in history], ['2023-05-31', '2023-06-01', '2023-06-05'])
+        names = [task.name for day, tasks in history for task in tasks if task.name == 'b']
+        self.assertIs(names[0], names[1])
+        self.assertEqual(sum(task.get_total_time_spent() for day, tasks in history for task in tasks), 9)
+
+    def test_summary_cache(self):
+        self.assertEqual(build_report('./tmp/')['totals']['total'], 9)
+        self.assertTrue(os.path.exists('./tmp/summary_cache.json'))
+        filepath = './tmp/2023-06-05_Monday.json'
+        stat = os.stat(filepath)
+        # same size and mtime: the cached summary is used
+        tl = TimeLogger(filepath)
+        tl.rename_task('b', 'c')
+        tl.write_snapshot()
+        os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(build_report('./tmp/')['tasks'], {'a': 3, '.lunch': 1, 'b': 5})
+        self.assertEqual(build_report('./tmp/', use_cache=False)['tasks'], {'a': 3, '.lunch': 1, 'b': 4, 'c': 1})
+        tl = TimeLogger(filepath)
+        tl.command_create_rename_merge('c=9-10')
+        tl.save_tasks_to_file()
+        self.assertEqual(build_report('./tmp/')['tasks'], {'a': 3, '.lunch': 1, 'b': 4, 'c': 2})
+
+class TaskUndoJournal(unittest.TestCase):
+    def setUp(self):
+        self.tl = TimeLogger('./tmp/' + today_datetime.strftime("%Y-%m-%d_%A.json"))
+        self.tl.tasks = []
+
+    def command(self, command):
+        self.tl.keep_history()
+        self.tl.command_create_rename_merge(command)
+
+    def test_undo_redo(self):
+        self.command('a=9-12')
+        self.command('b=10-11')
+        self.command('c')
+        self.assertEqual(self.tl.get_task('a').get_total_time_spent(), 2)
+        self.tl.undo()
+        self.assertEqual(self.tl.get_task('c'), None)
+        self.tl.undo()
+        self.assertEqual(self.tl.get_task('b'), None)
+        self.assertEqual(self.tl.get_task('a').get_total_time_spent(), 3)
+        self.assertEqual(len(self.tl.get_task('a').time_blocks), 1)
+        self.tl.redo()
+        self.assertEqual(self.tl.get_task('a').get_total_time_spent(), 2)
+        self.assertEqual(self.tl.get_task('b').get_total_time_spent(), 1)
+        self.tl.redo()
+        self.assertTrue(self.tl.get_task('c').is_active())
+        self.assertFalse(self.tl.journal.can_redo())
+
+    def test_undo_merge_rename_remove_stop(self):
+        self.command('a=9-10')
+        self.command('b=11-12')
+        self.command('a=b')
+        self.command('a=renamed')
+        self.tl.keep_history()
+        self.tl.command_remove('rm renamed')
+        self.assertEqual(len(self.tl.tasks), 0)
+        self.tl.undo()
+        self.assertEqual(self.tl.get_task('renamed').get_total_time_spent(), 2)
+        self.tl.undo()
+        self.tl.undo()
+        self.assertEqual(self.tl.get_task('a').get_total_time_spent(), 1)
+        self.assertEqual(self.tl.get_task('b').get_total_time_spent(), 1)
+        self.command('c')
+        self.tl.keep_history()
+        self.tl.command_stop()
+        self.assertFalse(self.tl.get_task('c').is_active())
+        self.tl.undo()
+        self.assertTrue(self.tl.get_task('c').is_active())
+
+    def test_budget_evicts_oldest_entries(self):
+        self.tl = TimeLogger('./tmp/' + today_datetime.strftime("%Y-%m-%d_%A.json"), undo_budget=10)
+        self.tl.command_next_day()
+        self.assertEqual(self.tl.journal.budget, 10)
+        for i in range(20):
+            self.command(f'task {i}')
+        self.assertTrue(self.tl.journal.size <= 10 or len(self.tl.journal.history) == 1)
+        self.assertTrue(len(self.tl.journal.history) < 20)
+        while self.tl.journal.can_undo():
+            self.tl.undo()
+        self.assertTrue(len(self.tl.tasks) > 0)
+
+class TaskVocabulary(unittest.TestCase):
+    def tearDown(self):
+        shutil.rmtree('./tmp/', ignore_errors=True)
+
+    def run_commands(self, path, commands):
+        tl = TimeLogger(path)
+        for command in commands:
+            tl.command_create_rename_merge(command)
+        tl.save_tasks_to_file()
+        return tl
+
+    def test_ranked_by_frequency_and_recency(self):
+        for day in ['2022-01-03_Monday', '2022-01-04_Tuesday', '2022-01-05_Wednesday']:
+            self.run_commands(f'./tmp/{day}.json', ['old often=9-10', 'team sync=10-11'])
+        self.run_commands('./tmp/2023-05-30_Tuesday.json', ['new=9-10', 'team sync=10-11'])
+        self.run_commands('./tmp/2023-05-31_Wednesday.json', ['team sync=10-11'])
+        vocabulary = Vocabulary.load_or_build('./tmp/')
+        self.assertEqual(vocabulary.ranked(), ['team sync', 'new', 'old often'])
+        self.assertTrue(os.path.exists('./tmp/vocabulary.json'))
+        self.assertEqual(Vocabulary('./tmp/').ranked(), vocabulary.ranked())
+
+    def test_saves_update_vocabulary(self):
+        self.run_commands('./tmp/2023-05-30_Tuesday.json', ['a=9-10', 'b=10-11'])
+        Vocabulary.load_or_build('./tmp/')
+        tl = self.run_commands('./tmp/2023-05-31_Wednesday.json', ['b=9-10', 'c=10-11'])
+        self.assertEqual(Vocabulary('./tmp/').ranked(), ['b', 'c', 'a'])
+        tl.command_create_rename_merge('c=renamed')
+        tl.save_tasks_to_file()
+        vocabulary = Vocabulary('./tmp/')
+        self.assertEqual(vocabulary.ranked(), ['b', 'renamed', 'a'])
+        rebuilt = Vocabulary('./tmp/')
+        rebuilt.rebuild()
+        self.assertEqual(rebuilt.ranked(), vocabulary.ranked())
+        for name, score in rebuilt.scores.items():
+            self.assertAlmostEqual(vocabulary.scores[name], score)
+
+    def assert_equals_rebuilt(self):
+        vocabulary = Vocabulary('./tmp/')
+        rebuilt = Vocabulary('./tmp/')
+        rebuilt.rebuild()
+        self.assertEqual(vocabulary.scores.keys(), rebuilt.scores.keys())
+        for name, score in rebuilt.scores.items():
+            self.assertAlmostEqual(vocabulary.scores[name], score)
+
+    @unittest.skipUnless(os.name == 'posix', 'needs fcntl')
+    def test_two_processes_keep_vocabulary_exact(self):
+        path = './tmp/2023-05-31_Wednesday.json'
+        self.run_commands('./tmp/2023-05-30_Tuesday.json', ['a=9-10'])
+        Vocabulary.load_or_build('./tmp/')
+        first = TimeLogger(path)
+        second = TimeLogger(path)
+        append = timelogger.append_to_sidecar_log
+        appends = []
+        def locked_append(filepath, update):
+            appends.append(is_directory_locked('./tmp/'))
+            return append(filepath, update)
+        with unittest.mock.patch('timelogger.append_to_sidecar_log', locked_append):
+            for tl, command in [(first, 'a=9-10'), (second, 'b=10-11'), (first, 'a=renamed'), (second, 'c=11-12')]:
+                tl.command_create_rename_merge(command)
+                tl.save_tasks_to_file()
+        self.assertEqual(appends, [True] * 4)
+        self.assertEqual(sorted(task.name for task in TimeLogger(path).tasks), ['b', 'c', 'renamed'])
+        self.assert_equals_rebuilt()
+
+    def test_saves_append_their_day(self):
+        self.run_commands('./tmp/2023-05-30_Tuesday.json', ['a=9-10'])
+        Vocabulary.load_or_build('./tmp/')
+        stat = os.stat('./tmp/vocabulary.json')
+        tl = self.run_commands('./tmp/2023-05-31_Wednesday.json', ['b=9-10'])
+        tl.command_create_rename_merge('b=c')
+        tl.save_tasks_to_file()
+        self.assertEqual(os.stat('./tmp/vocabulary.json').st_ino, stat.st_ino)
+        with open('./tmp/vocabulary.json.log', 'r') as file:
+            self.assertEqual([json.loads(line) for line in file], [{'day': '2023-05-31', 'names': ['b']}, {'day': '2023-05-31', 'names': ['c']}])
+        self.assertEqual(Vocabulary('./tmp/').ranked(), ['c', 'a'])
+        self.assert_equals_rebuilt()
+        with unittest.mock.patch('timelogger.LOG_COMPACTION_THRESHOLD', 50):
+            tl.command_create_rename_merge('d=10-11')
+            tl.save_tasks_to_file()
+        self.assertFalse(os.path.exists('./tmp/vocabulary.json.log'))
+        self.assertEqual(Vocabulary('./tmp/').ranked(), ['c', 'd', 'a'])
+        self.assert_equals_rebuilt()
+
+    def test_log_left_behind_by_compaction(self):
+        # a crash after the snapshot was written leaves the log it took in
+        self.run_commands('./tmp/2023-05-30_Tuesday.json', ['a=9-10'])
+        Vocabulary.load_or_build('./tmp/')
+        self.run_commands('./tmp/2023-05-31_Wednesday.json', ['a=9-10', 'b=10-11'])
+        shutil.copy('./tmp/vocabulary.json.log', './tmp/log')
+        vocabulary = Vocabulary('./tmp/')
+        vocabulary.changed = True
+        vocabulary.save()
+        os.rename('./tmp/log', './tmp/vocabulary.json.log')
+        self.assert_equals_rebuilt()
+
+    def test_older_vocabulary_is_rebuilt(self):
+        self.run_commands('./tmp/2023-05-30_Tuesday.json', ['a=9-10'])
+        with open('./tmp/vocabulary.json', 'w') as file:
+            json.dump({'version': 1, 'half_life_days': timelogger.VOCABULARY_HALF_LIFE_DAYS,
+                       'epoch': timelogger.VOCABULARY_EPOCH.isoformat(), 'names': {'a': 1.0}}, file)
+        self.assertFalse(Vocabulary('./tmp/').loaded)
+        self.assertEqual(Vocabulary.load_or_build('./tmp/').ranked(), ['a'])
+        self.assertTrue(Vocabulary('./tmp/').loaded)
+
+    def test_completion_uses_ranking(self):
+        completer = AutoCompleter(['exit'], [])
+        completer.current_tasks = [Task('team sync', current_datetime)]
+        completer.history = ['team sync', 'tax return', 'team lunch']
+        suggestions = []
+        while completer.complete('t', len(suggestions)) is not None:
+            suggestions.append(completer.complete('t', len(suggestions)))
+        self.assertEqual(suggestions, ['team sync', 'tax return', 'team lunch'])
+
 class TaskAutoCompleter(unittest.TestCase):
     def setUp(self):
         cmds = ['exit','rm ', 'help']
@@ -519,6 +1705,33 @@ class TaskAutoCompleter(unittest.TestCase):
         self.assertEqual(self.c.complete('UNKNOWN=M'),None)
         self.assertEqual(self.c.complete('0='),'0=TASK-1234')
 
+    def test_fuzzy_completer(self):
+        self.assertEqual(self.c.complete('tsk42'),None)
+        self.c.fuzzy_limit = 2
+        self.assertEqual(self.c.complete('tsk42'),'TASK-42')
+        self.assertEqual(self.c.complete('rm ask'),'rm TASK-42')
+        self.assertEqual(self.c.complete('rm ask', 1),'rm TASK-1234')
+        self.assertEqual(self.c.complete('rm ask', 2),None)
+        self.assertEqual(self.c.complete('TASK-42=mtg'),'TASK-42=MEETING')
+
+    def test_indexes_are_rebuilt_on_change_only(self):
+        self.c.complete('T')
+        names_index = self.c.task_names_index
+        self.c.complete('O')
+        self.assertIs(self.c.task_names_index, names_index)
+        self.c.current_tasks[0].name = 'RENAMED'
+        self.assertEqual(self.c.complete('REN'),'RENAMED')
+        self.assertIsNot(self.c.task_names_index, names_index)
+        self.c.history.append('from history')
+        self.assertEqual(self.c.complete('from'),'from history')
+
+    def test_prefix_index_matches_filter(self):
+        rng = random.Random(11)
+        candidates = [''.join(rng.choice('abAB-') for _ in range(rng.randint(0, 4))) for _ in range(200)]
+        index = PrefixIndex(candidates)
+        for prefix in ['', 'a', 'A', 'ab', 'b-', 'BaB', 'zz']:
+            self.assertEqual(index.lookup(prefix), [candidate for candidate in candidates if candidate.lower().startswith(prefix.lower())])
+
 class TaskToRunAfterAllTests(unittest.TestCase):
     def test_all_files_saved_in_test_are_deleted_after(self):
         self.assertFalse(os.path.exists('./tmp/'))
@@ -1,25 +1,64 @@
 #/bin/python3
 
-from datetime import datetime, timedelta, date, time
-from dateutil.relativedelta import relativedelta
+from datetime import datetime, timedelta, date, time, timezone
+from array import array
 from enum import Enum
-import argparse
-import copy
+import bisect
+import functools
+import itertools
 import json
+import math
 import os
 import re
-import readline
 import sys
+import tempfile
 import time
 
-def hours_since_midnight():
-    now = datetime.now()
-    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    delta = now - midnight
-    return delta.total_seconds() / 3600
+# the status line for shell prompts lives in its own small module
+from timelogger_status import STATUS_FILE_NAME, format_hours, status_line
+
+# Completion candidates sorted by their lower-cased text. A prefix lookup bisects
+# the matching range and returns the matches in their original order.
+class PrefixIndex:
+    def __init__(self, candidates):
+        self.candidates = list(candidates)
+        keyed = sorted((candidate.lower(), rank) for rank, candidate in enumerate(self.candidates))
+        self.keys = [key for key, rank in keyed]
+        self.ranks = [rank for key, rank in keyed]
+
+    def lookup(self, prefix):
+        prefix = prefix.lower()
+        first = bisect.bisect_left(self.keys, prefix)
+        last = bisect.bisect_left(self.keys, prefix + chr(0x10FFFF), first)
+        if last - first == len(self.keys):
+            return list(self.candidates)
+        return [self.candidates[rank] for rank in sorted(self.ranks[first:last])]
+
+    def fuzzy(self, query, limit):
+        # candidates containing the letters of query in order, best ranked first:
+        # substring matches before scattered ones, earlier and tighter matches first
+        query = query.lower()
+        ranked = []
+        for key, rank in zip(self.keys, self.ranks):
+            position = key.find(query)
+            if position >= 0:
+                ranked.append(((0, position, len(key)), rank))
+                continue
+            positions = []
+            for char in query:
+                position = key.find(char, positions[-1] + 1 if positions else 0)
+                if position < 0:
+                    break
+                positions.append(position)
+            else:
+                ranked.append(((1, positions[-1] - positions[0], len(key)), rank))
+        ranked.sort()
+        return [self.candidates[rank] for score, rank in ranked[:limit]]
 
 class AutoCompleter:
-    def __init__(self , cmds = [], known_params = []):
+    def __init__(self , cmds = [], known_params = [], fuzzy_limit = 0):
+        # imported here, so non-interactive modes like --status start faster
+        import readline
         readline.set_completer(self.complete)
         readline.parse_and_bind("tab: complete")
         readline.set_completer_delims('\t\n')
@@ -27,6 +66,34 @@ class AutoCompleter:
         self.known_params = known_params
         self.history = []
         self.suggestions = []
+        # > 0: without prefix matches, suggest up to this many fuzzy matches
+        self.fuzzy_limit = fuzzy_limit
+        self.indexed_lists = None
+        self.indexed_history = None
+        self.indexed_task_names = None
+
+    def update_indexes(self):
+        # rebuilt only when the candidate lists or the task names changed
+        indexed_lists = (id(self.cmds), len(self.cmds), id(self.known_params), len(self.known_params))
+        if indexed_lists != self.indexed_lists:
+            self.cmds_index = PrefixIndex(self.cmds)
+            self.params_index = PrefixIndex(self.known_params)
+            self.prefix_cmds = [cmd for cmd in self.cmds if cmd.endswith(' ')]
+            self.indexed_lists = indexed_lists
+        indexed_history = (id(self.history), len(self.history))
+        if indexed_history != self.indexed_history:
+            self.history_index = PrefixIndex(self.history)
+            self.indexed_history = indexed_history
+        task_names = tuple(task.name for task in self.current_tasks)
+        if task_names != self.indexed_task_names:
+            self.task_names_index = PrefixIndex(task_names)
+            self.task_names_set = set(task_names)
+            self.indexed_task_names = task_names
+
+    def is_task_ref(self, task_ref):
+        if task_ref in self.task_names_set:
+            return True
+        return task_ref.isdigit() and str(int(task_ref)) == task_ref and int(task_ref) < len(self.indexed_task_names)
 
     def remove_double_param_use_suggestions(self):
         unique_lst = []
@@ -45,11 +112,10 @@ class AutoCompleter:
 
     def complete(self, raw_current_input, state = 0):
         if state == 0:
+            self.update_indexes()
             current_input = raw_current_input.lstrip()
-            current_tasks_names = [task.name for task in self.current_tasks]
-            current_tasks_ids = [str(i) for i in range(len(self.current_tasks))]
             if raw_current_input == ' ' or raw_current_input == '/':
-                self.suggestions = current_tasks_names + self.known_params
+                self.suggestions = list(self.indexed_task_names) + self.known_params
             elif current_input == '':
                 self.suggestions = self.cmds + ['[Space]+[Tab]:TaskNames']
             else:
@@ -57,21 +123,30 @@ class AutoCompleter:
                 if "=" in current_input:
                     current_prefix = current_input.rpartition("=")[0] + "="
                 else:
-                    prefix_list = [cmd for cmd in self.cmds if cmd.endswith(' ')]
-                    current_prefix = ([prefix for prefix in prefix_list if current_input.startswith(prefix)]+[''])[0]
+                    current_prefix = ([prefix for prefix in self.prefix_cmds if current_input.startswith(prefix)]+[''])[0]
+                # every candidate below starts with current_prefix, so only the rest is looked up
+                rest = current_input[len(current_prefix):]
                 prefixed_params = []
-                if "=" not in current_input: 
-                    prefixed_params = [current_prefix + name for name in current_tasks_names]
-                if "=" in current_input and current_prefix.rstrip("=") in current_tasks_names + current_tasks_ids:
-                    prefixed_params = [current_prefix + name for name in current_tasks_names]
-                    prefixed_params = prefixed_params + [current_prefix + name for name in self.known_params]
-                if current_input.endswith('=') and current_prefix.rstrip("=") not in current_tasks_names + current_tasks_ids:
+                if "=" not in current_input:
+                    prefixed_params = [current_prefix + name for name in self.task_names_index.lookup(rest)]
+                if "=" in current_input and self.is_task_ref(current_prefix.rstrip("=")):
+                    prefixed_params = [current_prefix + name for name in self.task_names_index.lookup(rest)]
+                    prefixed_params = prefixed_params + [current_prefix + name for name in self.params_index.lookup(rest)]
+                if current_input.endswith('=') and not self.is_task_ref(current_prefix.rstrip("=")):
                     prefixed_params = [current_prefix + self.last_full_quater_time() + '-now']
-                possible_suggestions = self.cmds + self.known_params + prefixed_params
+                possible_suggestions = self.cmds_index.lookup(current_input) + self.params_index.lookup(current_input) + prefixed_params
                 for ending in ['-now','now','ow','w']:
-                    if "=" in current_input and TimeBlock.is_valid_range(current_input.rpartition("=")[-1] + ending):
+                    if "=" in current_input and TimeBlock.is_valid_range(rest + ending):
                         possible_suggestions.append(current_input+ending)
-                self.suggestions = [cmd for cmd in possible_suggestions + self.history if cmd.lower().startswith(current_input.lower()) and cmd != current_input]
+                possible_suggestions += [name for name in self.history_index.lookup(current_input) if name not in possible_suggestions]
+                self.suggestions = [cmd for cmd in possible_suggestions if cmd != current_input]
+                if len(self.suggestions) == 0 and self.fuzzy_limit > 0 and rest != '':
+                    candidates = self.task_names_index.fuzzy(rest, self.fuzzy_limit)
+                    if "=" in current_input:
+                        candidates += self.params_index.fuzzy(rest, self.fuzzy_limit)
+                    else:
+                        candidates += [name for name in self.history_index.fuzzy(rest, self.fuzzy_limit) if name not in candidates]
+                    self.suggestions = [current_prefix + candidate for candidate in candidates[:self.fuzzy_limit]]
                 self.remove_double_param_use_suggestions()
         try:
             return self.suggestions[state]
@@ -106,15 +181,94 @@ def now_for_date(source_datetime):
     new_datetime = datetime.combine(source_datetime.date(), current_time)
     return new_datetime
 
+TIME_PATTERN = re.compile(r'^(2[0-3]|[0-1]?[0-9])(:[0-5][0-9])?$')
+
+# Parses and formats the "HH:MM" times of one day against its midnight epoch,
+# computed once per day, instead of building a datetime per time. On days
+# with a DST switch parsing falls back to datetime, which knows the offsets.
+class DayClock:
+    last = None
+
+    def __init__(self, day):
+        midnight = datetime(day.year, day.month, day.day)
+        self.day = day
+        self.midnight = midnight.timestamp()
+        self.next_midnight = (midnight + timedelta(days=1)).timestamp()
+        self.regular_day = self.next_midnight - self.midnight == 24 * 3600
+
+    @staticmethod
+    def for_timestamp(timestamp):
+        # the clock of the day a timestamp falls on, reusing the last one looked up
+        clock = DayClock.last
+        if clock is None or not (clock.midnight <= timestamp < clock.next_midnight):
+            clock = day_clock(date.fromtimestamp(timestamp))
+            DayClock.last = clock
+        return clock
+
+    def parse(self, time_string):
+        match = TIME_PATTERN.match(time_string)
+        if match is None:
+            return None
+        h = int(match.group(1))
+        m = int(match.group(2)[1:]) if match.group(2) else 0
+        if self.regular_day:
+            return self.midnight + h * 3600 + m * 60
+        return datetime(self.day.year, self.day.month, self.day.day, h, m).timestamp()
+
+    def parse_range(self, time_range):
+        # same rules as TimeBlock(day, time_range): (None, None) for invalid ranges, end None for 'now'
+        s, e = time_range.split('-')
+        start = self.parse(s)
+        end = self.parse(e)
+        if start is None or (end is not None and int(start) >= int(end)):
+            return None, None
+        return start, end
+
+    def format_time(self, timestamp):
+        today = int(self.midnight)
+        h = int((timestamp - today) / 3600)
+        m = int((timestamp - today) / 60) - (h * 60)
+        return f"{h:02d}:{m:02d}"
+
+    def format_range(self, start, end, split='-'):
+        if start is None:
+            return 'Not Booked...'
+        end_time = 'now' if end is None else self.format_time(end)
+        return f"{self.format_time(start)}{split}{end_time}"
+
+    def format_blocks(self, starts, ends, split='-'):
+        # many blocks of this day at once, accepts None or NaN for missing values;
+        # split is one separator for all blocks or a list with one per block
+        formatted = []
+        splits = itertools.repeat(split) if isinstance(split, str) else split
+        for start, end, split in zip(starts, ends, splits):
+            start = None if start is None or start != start else start
+            end = None if end is None or end != end else end
+            if start is not None and not (self.midnight <= start < self.next_midnight):
+                formatted.append(DayClock.for_timestamp(start).format_range(start, end, split))
+            else:
+                formatted.append(self.format_range(start, end, split))
+        return formatted
+
+@functools.lru_cache(maxsize=64)
+def day_clock(day):
+    return DayClock(day)
+
+def block_order(block):
+    # closed blocks by start, open ones after them
+    return (block.end is None, block.start)
+
 class TimeBlock:
+    __slots__ = ('start', 'end')
+
     def __init__(self, current_datetime, time_range=None):
         if time_range is None:
             self.start = now_for_date(date_to_datetime(current_datetime)).timestamp()
             self.end = None
         else:
             s, e = time_range.split('-')
-            self.start = self.string_to_timestamp(date_to_datetime(current_datetime), s)
-            self.end = self.string_to_timestamp(date_to_datetime(current_datetime), e)
+            self.start = self.string_to_timestamp(current_datetime, s)
+            self.end = self.string_to_timestamp(current_datetime, e)
         if self.start is None:
             self.end = None
         elif self.end is not None and int(self.start) >= int(self.end):
@@ -126,13 +280,14 @@ class TimeBlock:
         if not time_range.count('-') == 1:
             return False
         s, e = time_range.split('-')
-        start = TimeBlock.string_to_timestamp(datetime.now(), s)
-        end = TimeBlock.string_to_timestamp(datetime.now(), e)
-        return start is not None and (end is not None or e == 'now')
+        return TIME_PATTERN.match(s) is not None and (TIME_PATTERN.match(e) is not None or e == 'now')
 
     @staticmethod
     def string_to_timestamp(today_datetime, time_string):
-        if re.match(r'^(2[0-3]|[0-1]?[0-9])(:[0-5][0-9])?$', time_string) is None:
+        if getattr(today_datetime, 'tzinfo', None) is None:
+            day = today_datetime.date() if isinstance(today_datetime, datetime) else today_datetime
+            return day_clock(day).parse(time_string)
+        if TIME_PATTERN.match(time_string) is None:
             return None
         if ':' in time_string:
             h, m = map(int, time_string.split(':'))
@@ -146,16 +301,7 @@ class TimeBlock:
     def to_string(self, split='-'):
         if self.start is None:
             return 'Not Booked...'
-        today = int(datetime.fromtimestamp(self.start).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
-        start_h = int((self.start - today) / 3600)
-        start_min = int((float((self.start - today) / 60) - (start_h * 60)))
-        start_time = f"{start_h:02d}:{start_min:02d}"
-        end_time = 'now'
-        if self.end is not None:
-            end_h = int((self.end - today) / 3600)
-            end_min = int((self.end - today) / 60) - (end_h * 60)
-            end_time = f"{end_h:02d}:{end_min:02d}"
-        return f"{start_time}{split}{end_time}"
+        return DayClock.for_timestamp(self.start).format_range(self.start, self.end, split)
 
     def to_json(self):
         return {
@@ -171,26 +317,22 @@ class TimeBlock:
             return self.start < timestamp
         return self.start < timestamp and timestamp < self.end
 
-    def stop(self):
-        self.end = time.time()
-
-    def none_timestamps_to_inf(self,obj):
-        max_timestamp = float('inf')
-        obj_copy = copy.deepcopy(obj)
-        obj_copy.start = max_timestamp if obj_copy.start is None else obj_copy.start
-        obj_copy.end = max_timestamp if obj_copy.end is None else obj_copy.end
-        return obj_copy
+    def stop(self, end=None):
+        self.end = time.time() if end is None else end
 
     def would_be_without(self, block_needing_space):
-        old = self.none_timestamps_to_inf(self)
-        new = self.none_timestamps_to_inf(block_needing_space)
-        if old.start < new.start and old.end > new.end:
+        max_timestamp = float('inf')
+        old_start = max_timestamp if self.start is None else self.start
+        old_end = max_timestamp if self.end is None else self.end
+        new_start = max_timestamp if block_needing_space.start is None else block_needing_space.start
+        new_end = max_timestamp if block_needing_space.end is None else block_needing_space.end
+        if old_start < new_start and old_end > new_end:
             return TimeConflict.SPLIT
-        if old.start >= new.start and old.start < new.end and old.end > new.end:
+        if old_start >= new_start and old_start < new_end and old_end > new_end:
             return TimeConflict.CUTOFF_AT_START
-        if old.start < new.start and old.end > new.start and old.end <= new.end:
+        if old_start < new_start and old_end > new_start and old_end <= new_end:
             return TimeConflict.CUTOFF_AT_END
-        if old.start >= new.start and old.end <= new.end:
+        if old_start >= new_start and old_end <= new_end:
             return TimeConflict.REMOVED
         return TimeConflict.UNCHANGED
 
@@ -204,6 +346,13 @@ class TimeBlock:
         new_block.end = block_needing_space.start
         return new_block
 
+    @staticmethod
+    def from_timestamps(start, end):
+        block = TimeBlock.__new__(TimeBlock)
+        block.start = start
+        block.end = end
+        return block
+
     def time_spent(self):
         if self.start is None:
             return 0
@@ -213,28 +362,153 @@ class TimeBlock:
             return float((self.end - self.start)/ 3600)
     
 
+# TimeBlock-style view on one block of a TimeBlockColumns, None is stored as NaN
+class TimeBlockView(TimeBlock):
+    __slots__ = ('columns', 'index')
+
+    def __init__(self, columns, index):
+        self.columns = columns
+        self.index = index
+
+    @property
+    def start(self):
+        value = self.columns.starts[self.index]
+        return None if math.isnan(value) else value
+
+    @start.setter
+    def start(self, value):
+        self.columns.starts[self.index] = math.nan if value is None else value
+
+    @property
+    def end(self):
+        value = self.columns.ends[self.index]
+        return None if math.isnan(value) else value
+
+    @end.setter
+    def end(self, value):
+        self.columns.ends[self.index] = math.nan if value is None else value
+
+# Columnar storage of a task's time blocks in two array('d') buffers, used by
+# Task.compact() to keep long histories in memory for analysis. It supports the
+# read access Task uses (len, index, iteration) and append, but not the in place
+# edits of the interactive commands; Task.expand() turns it back into a list.
+class TimeBlockColumns:
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, blocks=()):
+        self.starts = array('d')
+        self.ends = array('d')
+        for block in blocks:
+            self.append(block)
+
+    def append(self, block):
+        self.starts.append(math.nan if block.start is None else block.start)
+        self.ends.append(math.nan if block.end is None else block.end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('time block index out of range')
+        return TimeBlockView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield TimeBlockView(self, index)
+
+    def to_list(self):
+        return [TimeBlock.from_timestamps(block.start, block.end) for block in self]
+
+# Block array of a task in a v2 day file, decoded on first access. The header
+# holds the task's summary, which answers most questions without decoding.
+class LazyTimeBlocks:
+    __slots__ = ('text', 'position', 'length', 'header')
+
+    def __init__(self, text, position, header):
+        self.text = text
+        self.position = position
+        self.length = header['blocks_length']
+        self.header = header
+
+    def decode(self):
+        pairs, _ = JSON_DECODER.raw_decode(self.text, self.position)
+        return [TimeBlock.from_timestamps(start, end) for start, end in pairs]
+
+    def raw(self):
+        return self.text[self.position:self.position + self.length]
+
+JSON_DECODER = json.JSONDecoder()
+
 class Task:
+    __slots__ = ('current_datetime', 'name', 'description', '_time_blocks', 'lazy_time_blocks')
+
     def __init__(self, name, current_datetime):
         self.current_datetime = current_datetime
         self.name = name
         self.description = ""
         self.time_blocks = []
 
+    @property
+    def time_blocks(self):
+        if self._time_blocks is None:
+            self._time_blocks = self.lazy_time_blocks.decode()
+            self.lazy_time_blocks = None
+        return self._time_blocks
+
+    @time_blocks.setter
+    def time_blocks(self, time_blocks):
+        self._time_blocks = time_blocks
+        self.lazy_time_blocks = None
+
+    def is_decoded(self):
+        return self._time_blocks is not None
+
+    def block_count(self):
+        if not self.is_decoded():
+            return self.lazy_time_blocks.header['count']
+        return len(self.time_blocks)
+
     def is_active(self):
+        if not self.is_decoded():
+            return self.lazy_time_blocks.header['active']
         return len(self.time_blocks) > 0 and self.time_blocks[-1].end is None
 
     def is_unpaid(self):
         return self.name.startswith('.')
 
-    def start(self):
+    def start(self, at=None):
         if not self.is_active():
             if len(self.time_blocks) > 0 and self.time_blocks[-1].end is None:
                 self.stop()
-            self.time_blocks.append(TimeBlock(self.current_datetime))
+            if at is None:
+                block = TimeBlock(self.current_datetime)
+            else:
+                block = TimeBlock.from_timestamps(at, None)
+            self.insert_time_block(block)
 
-    def stop(self):
+    def stop(self, end=None):
+        # returns the end of the stopped block, which moves among the closed blocks
         if len(self.time_blocks) > 0 and self.time_blocks[-1].end is None:
-            self.time_blocks[-1].stop()
+            block = self.time_blocks.pop()
+            if end is None:
+                end = time.time()
+                clock = DayClock.for_timestamp(block.start)
+                if end >= clock.next_midnight:
+                    # on a past day the time of day counts, like for starts, but a block
+                    # left open over night ends at the midnight after its start
+                    end = clock.midnight + end - DayClock.for_timestamp(end).midnight
+                    if end < block.start:
+                        end = clock.next_midnight
+            # a block started later today than now, or a switch on a past day, ends where it starts
+            block.stop(max(end, block.start))
+            self.insert_time_block(block)
+            return block.end
+        return None
 
     def add_time_block(self, time_range):
         new_block = time_range
@@ -243,38 +517,142 @@ class Task:
         # Add only valid time blocks
         if new_block.start is not None:
             self.remove_conflicts_with(new_block)
-            self.time_blocks.append(new_block)
-            self.time_blocks = sorted(self.time_blocks)
+            self.insert_time_block(new_block)
+
+    # time_blocks are kept sorted by start, with an open block after the closed
+    # ones, which lets the checks and the merge below work in one sweep over the blocks
+    def is_sorted(self):
+        return all(block_order(previous) <= block_order(block) for previous, block in zip(self.time_blocks, self.time_blocks[1:]))
+
+    def has_mergeable_time_blocks(self):
+        if not self.is_sorted():
+            return True
+        closed = self.time_blocks
+        if len(closed) > 0 and closed[-1].end is None:
+            closed = closed[:-1]
+            if self.open_block_position(closed, self.time_blocks[-1]) is not None:
+                return True
+        return any(previous.end is None or block.start <= previous.end for previous, block in zip(closed, closed[1:]))
+
+    @staticmethod
+    def open_block_position(closed, open_block):
+        # position of the closed block the open block's start falls into
+        index = bisect.bisect_right(closed, open_block) - 1
+        if index >= 0 and open_block.start <= closed[index].end:
+            return index
+        return None
 
     def merge_touching_time_blocks(self):
-        merged = False
-        for i, time_block in enumerate(self.time_blocks):
-            for j, any_other_block  in enumerate(self.time_blocks):
-                if i != j:
-                    if time_block.end == any_other_block.start:
-                        time_block.end = any_other_block.end
-                        self.time_blocks.pop(j)
-                        merged = True
-                        break
-        if merged:
-            self.merge_touching_time_blocks()
+        if not self.is_sorted():
+            self.time_blocks.sort(key=block_order)
+        merged = []
+        open_block = None
+        for block in self.time_blocks:
+            if block.end is None:
+                # further open blocks started while the first one was running
+                if open_block is None:
+                    open_block = block
+            elif len(merged) > 0 and block.start <= merged[-1].end:
+                if block.end > merged[-1].end:
+                    merged[-1].end = block.end
+            else:
+                merged.append(block)
+        if open_block is not None:
+            # the open block takes in the block it started in, blocks booked after its start stay
+            index = self.open_block_position(merged, open_block)
+            if index is not None:
+                open_block.start = merged.pop(index).start
+            merged.append(open_block)
+        self.time_blocks = merged
 
     def remove_conflicts_with(self, conflict_block):
         # Add only valid time blocks
         if conflict_block.start is not None:
             # Remove intersecting
-            self.time_blocks = [block for block in self.time_blocks if (block.would_be_without(conflict_block) is not TimeConflict.REMOVED)]
-            for block in self.time_blocks:
-                conflict = block.would_be_without(conflict_block)
-                if conflict is TimeConflict.SPLIT:
-                    split_block = copy.deepcopy(block)
-                    block.start = conflict_block.end
-                    split_block.end = conflict_block.start
-                    self.time_blocks.append(split_block)
-                elif conflict is TimeConflict.CUTOFF_AT_START:
-                    block.start = conflict_block.end
-                elif conflict is TimeConflict.CUTOFF_AT_END:
-                    block.end = conflict_block.start
+            for block in [block for block in self.time_blocks if block.would_be_without(conflict_block) is not TimeConflict.UNCHANGED]:
+                self.cut_out(block, conflict_block)
+
+    def cut_out(self, block, conflict_block):
+        # Edits one of this task's blocks in place to make room for conflict_block,
+        # returns the blocks remaining from it
+        conflict = block.would_be_without(conflict_block)
+        if conflict is TimeConflict.REMOVED:
+            self.time_blocks.remove(block)
+            return []
+        if conflict is TimeConflict.SPLIT:
+            split_block = TimeBlock.from_timestamps(block.start, conflict_block.start)
+            if block.end is None:
+                self.insert_time_block(split_block)
+            else:
+                self.time_blocks.insert(self.time_blocks.index(block), split_block)
+            block.start = conflict_block.end
+            return [split_block, block]
+        if conflict is TimeConflict.CUTOFF_AT_START:
+            block.start = conflict_block.end
+        elif conflict is TimeConflict.CUTOFF_AT_END and block.end is None:
+            # the open block is closed, it moves among the closed blocks
+            self.time_blocks.remove(block)
+            block.end = conflict_block.start
+            self.insert_time_block(block)
+        elif conflict is TimeConflict.CUTOFF_AT_END:
+            block.end = conflict_block.start
+        return [block]
+
+    def insert_time_block(self, block):
+        closed_count = len(self.time_blocks)
+        while closed_count > 0 and self.time_blocks[closed_count - 1].end is None:
+            closed_count -= 1
+        # returns whether the block touches the blocks next to it, which then need a merge
+        blocks = self.time_blocks
+        if block.end is None:
+            index = bisect.bisect_right(blocks, block, closed_count)
+            blocks.insert(index, block)
+            return len(blocks) - closed_count > 1 or self.open_block_position(blocks[:closed_count], block) is not None
+        index = bisect.bisect_right(blocks, block, 0, closed_count)
+        blocks.insert(index, block)
+        if index > 0 and blocks[index - 1].end >= block.start:
+            return True
+        if index + 1 <= closed_count and blocks[index + 1].start <= block.end:
+            return True
+        return closed_count + 1 < len(blocks) and block.start <= blocks[closed_count + 1].start <= block.end
+
+    def remove_time_block(self, start, end):
+        # returns False when the task has no block from start to end
+        blocks = self.time_blocks
+        closed_count = len(blocks)
+        if closed_count > 0 and blocks[-1].end is None:
+            closed_count -= 1
+            if end is None and blocks[-1].start == start:
+                del blocks[-1]
+                return True
+        if end is None:
+            return False
+        index = bisect.bisect_left(blocks, TimeBlock.from_timestamps(start, end), 0, closed_count)
+        while index < closed_count and blocks[index].start == start:
+            if blocks[index].end == end:
+                del blocks[index]
+                return True
+            index += 1
+        return False
+
+    def memento(self):
+        return (self.name, self.description, tuple((block.start, block.end) for block in self.time_blocks))
+
+    def restore(self, memento):
+        self.name, self.description, blocks = memento
+        self.time_blocks = [TimeBlock.from_timestamps(start, end) for start, end in blocks]
+
+    def compact(self):
+        # names repeat across days, interning lets all days share one string
+        self.name = sys.intern(self.name)
+        if not isinstance(self.time_blocks, TimeBlockColumns):
+            self.time_blocks = TimeBlockColumns(self.time_blocks)
+        return self
+
+    def expand(self):
+        if isinstance(self.time_blocks, TimeBlockColumns):
+            self.time_blocks = self.time_blocks.to_list()
+        return self
 
     def set_description(self, description):
         self.description = description
@@ -283,43 +661,72 @@ class Task:
         # was_active is used here to overcome the problem with changed order of time-blocks after merging
         was_active=self.is_active()
         if was_active:
-            self.stop()
+            stopped_at = self.stop()
         for block in task.time_blocks:
             self.add_time_block(block)
         task.time_blocks=[]
         if was_active:
-            self.start()
+            self.start(stopped_at)
 
     def get_total_time_spent(self):
+        if not self.is_decoded():
+            return summary_hours(self.lazy_time_blocks.header, time.time())
         total_hours = 0
         for time_block in self.time_blocks:
             total_hours += time_block.time_spent()
         return total_hours
 
+    def summary(self):
+        # closed hours, start of a still open block, first start and last closed end
+        if not self.is_decoded():
+            header = self.lazy_time_blocks.header
+            return {key: header[key] for key in ['hours', 'open_start', 'first_start', 'last_end']}
+        summary = {'hours': 0, 'open_start': None, 'first_start': None, 'last_end': None}
+        for block in self.time_blocks:
+            if block.start is None:
+                continue
+            if block.end is None:
+                summary['open_start'] = block.start
+            else:
+                summary['hours'] += (block.end - block.start) / 3600
+                if summary['last_end'] is None or block.end > summary['last_end']:
+                    summary['last_end'] = block.end
+            if summary['first_start'] is None or block.start < summary['first_start']:
+                summary['first_start'] = block.start
+        return summary
+
     def __lt__(self, other):
         if self.get_first_start_time() is None or other.get_first_start_time() is None:
             return False
         return self.get_first_start_time() < other.get_first_start_time()
 
     def get_first_start_time(self):
+        if not self.is_decoded():
+            return self.lazy_time_blocks.header['first_start']
         if len(self.time_blocks) == 0:
             return None
-        if any(block.start is None for block in self.time_blocks):
-            return None
-        return sorted(self.time_blocks)[0].start
+        # an open block is last, but may have started before the closed blocks
+        return min(self.time_blocks[0].start, self.time_blocks[-1].start)
 
     def get_last_end_time(self):
+        if not self.is_decoded():
+            header = self.lazy_time_blocks.header
+            return None if header['active'] else header['last_end']
         if len(self.time_blocks) == 0:
             return None
-        if any(block.end is None for block in self.time_blocks):
-            return None
-        return sorted(self.time_blocks, key=lambda block: block.end)[-1].end
+        last_end = None
+        for block in self.time_blocks:
+            if block.end is None:
+                return None
+            if last_end is None or block.end > last_end:
+                last_end = block.end
+        return last_end
 
     def get_task_time_range(self):
         task_time_range = TimeBlock(self.current_datetime)
         task_time_range.start = self.get_first_start_time()
         task_time_range.end = self.get_last_end_time()
-        if len(self.time_blocks) > 1:
+        if self.block_count() > 1:
             return task_time_range.to_string('-+>')
         else:
             return task_time_range.to_string('-->')
@@ -332,6 +739,19 @@ class Task:
         }
         return json.dumps(data)
 
+    def raw_time_blocks(self):
+        if not self.is_decoded():
+            return self.lazy_time_blocks.raw()
+        return json.dumps([[block.start, block.end] for block in self.time_blocks])
+
+    @staticmethod
+    def load_from_header(current_datetime, header, lazy_time_blocks):
+        task = Task(header['name'], current_datetime)
+        task.description = header['description']
+        task._time_blocks = None
+        task.lazy_time_blocks = lazy_time_blocks
+        return task
+
     @staticmethod
     def load_from_json(current_datetime, json_str):
         data = json.loads(json_str)
@@ -340,15 +760,508 @@ class Task:
         time_blocks_data = data["time_blocks"]
         task = Task(name, current_datetime)
         task.description = description
-        for x in time_blocks_data:
-            block = TimeBlock(current_datetime)
-            block.start = x['start']
-            block.end = x['end']
-            task.time_blocks.append(block)
+        task.time_blocks = [TimeBlock.from_timestamps(x['start'], x['end']) for x in time_blocks_data]
+        if not task.is_sorted():
+            task.time_blocks.sort(key=block_order)
         return task
 
+def memento_block_order(block):
+    # block_order of the (start, end) pairs of a memento
+    return (block[1] is None, block[0] or 0)
+
+# One command in the undo journal. While the command runs, the tasks of the day
+# and the state of each task it touches are kept; once it is done the entry is
+# sealed into changes by task name: the names, descriptions and blocks the task
+# had before and after. Undo and redo apply a change as a 'restore' event on the
+# tasks of the day, which may since include the saves of another process.
+class JournalEntry:
+    def __init__(self, order):
+        self.order = order
+        self.states = {}
+        self.changes = None
+
+    def seal(self, tasks):
+        present = set(tasks)
+        before_present = set(self.order)
+        affected = list(self.states)
+        affected += [task for task in self.order if task not in present and task not in self.states]
+        affected += [task for task in tasks if task not in before_present and task not in self.states]
+        self.changes = []
+        for task in affected:
+            # tasks the command did not touch are as they were before it
+            before = self.states.get(task, task.memento()) if task in before_present else None
+            after = task.memento() if task in present else None
+            if before == after:
+                continue
+            before_blocks = set(before[2]) if before is not None else set()
+            after_blocks = set(after[2]) if after is not None else set()
+            self.changes.append({
+                'before': None if before is None else [before[0], before[1]],
+                'after': None if after is None else [after[0], after[1]],
+                'only_before': sorted(before_blocks - after_blocks, key=memento_block_order),
+                'only_after': sorted(after_blocks - before_blocks, key=memento_block_order),
+            })
+        # the order of the tasks by name, when the command changed it
+        self.names = None
+        before_names = [self.states[task][0] if task in self.states else task.name for task in self.order]
+        after_names = [task.name for task in tasks]
+        if before_names != after_names:
+            self.names = {'before': before_names, 'after': after_names}
+        self.order = None
+        self.states = None
+
+    def restore_events(self, source, target):
+        # (op, fields) of the events turning the source side of the changes into
+        # the target side; tasks are removed first, created last and then ordered
+        events = []
+        for change in self.changes:
+            events.append({
+                'name': None if change[source] is None else change[source][0],
+                'to': None if change[target] is None else change[target][0],
+                'description': '' if change[target] is None else change[target][1],
+                'remove': [list(block) for block in change['only_' + source]],
+                'add': [list(block) for block in change['only_' + target]],
+            })
+        events.sort(key=lambda event: (event['to'] is not None, event['name'] is None))
+        events = [('restore', event) for event in events]
+        if self.names is not None:
+            events.append(('order', {'names': self.names[target]}))
+        return events
+
+    def size(self):
+        if self.changes is not None:
+            names = 0 if self.names is None else len(self.names['before']) + len(self.names['after'])
+            return 1 + names + sum(1 + len(change['only_before']) + len(change['only_after']) for change in self.changes)
+        return len(self.order) + sum(1 + len(memento[2]) for memento in self.states.values())
+
+# Max number of task references and time blocks the undo journal of a day keeps,
+# --undo-budget changes it
+UNDO_BUDGET = 100000
+
+# Undo/redo journal storing, per command, the changes of only those tasks the
+# command touched (their state recorded on first touch). Undoing an entry
+# therefore costs O(touched blocks) instead of a deep copy of the whole day,
+# and as its changes refer to tasks by name, the journal outlives reloading
+# the day after a save of another process.
+class UndoJournal:
+    def __init__(self, budget=UNDO_BUDGET):
+        # budget: max number of task references and time blocks kept in total
+        self.budget = budget
+        self.history = []
+        self.redo_history = []
+        self.open_entry = None
+        self.size = 0
+
+    def begin(self, tasks):
+        self.seal(tasks)
+        for entry in self.redo_history:
+            self.size -= entry.size()
+        self.redo_history.clear()
+        self.open_entry = JournalEntry(list(tasks))
+        self.history.append(self.open_entry)
+        self.size += self.open_entry.size()
+        self.evict()
+
+    def seal(self, tasks):
+        # called once the command of the open entry is done, before tasks change otherwise
+        if self.open_entry is not None:
+            self.size -= self.open_entry.size()
+            self.open_entry.seal(tasks)
+            self.size += self.open_entry.size()
+            self.open_entry = None
+            self.evict()
+
+    def touch(self, task):
+        if self.open_entry is not None and task not in self.open_entry.states:
+            memento = task.memento()
+            self.open_entry.states[task] = memento
+            self.size += 1 + len(memento[2])
+            self.evict()
+
+    def evict(self):
+        while self.size > self.budget and len(self.history) > 1:
+            evicted = self.history.pop(0)
+            self.size -= evicted.size()
+
+    def can_undo(self):
+        return len(self.history) != 0
+
+    def can_redo(self):
+        return len(self.redo_history) != 0
+
+    def undo(self, tasks):
+        self.seal(tasks)
+        entry = self.history.pop()
+        self.redo_history.append(entry)
+        return entry.restore_events('after', 'before')
+
+    def redo(self, tasks):
+        self.seal(tasks)
+        entry = self.redo_history.pop()
+        self.history.append(entry)
+        return entry.restore_events('before', 'after')
+
+# Day file format v2: one JSON document written as
+#   {"version": 2, "tasks": [headers...], "blocks": [[[start, end], ...], ...]}
+# Each task header carries the task's totals, active flag and the position of
+# its block array relative to the "blocks" array, so a reader decodes only the
+# headers and each block array once its task's blocks are accessed.
+# Version 1 files, a JSON list of Task.get_json() strings, are still read.
+DAY_FILE_V2_PREFIX = '{"version": 2, "tasks": '
+DAY_FILE_V2_BLOCKS_KEY = ', "blocks": '
+
+def encode_day_file(tasks):
+    headers = []
+    raw_blocks = []
+    position = 1
+    for task in tasks:
+        raw = task.raw_time_blocks()
+        header = {'name': task.name, 'description': task.description, 'active': task.is_active(), 'count': task.block_count()}
+        header.update(task.summary())
+        header['blocks_at'] = position
+        header['blocks_length'] = len(raw)
+        headers.append(header)
+        raw_blocks.append(raw)
+        position += len(raw) + 1
+    return DAY_FILE_V2_PREFIX + json.dumps(headers) + DAY_FILE_V2_BLOCKS_KEY + '[' + ','.join(raw_blocks) + ']}'
+
+def decode_day_file(text, current_datetime):
+    # returns the tasks and the format version of the file
+    if text.startswith(DAY_FILE_V2_PREFIX):
+        headers, end = JSON_DECODER.raw_decode(text, len(DAY_FILE_V2_PREFIX))
+        if text.startswith(DAY_FILE_V2_BLOCKS_KEY, end):
+            blocks_start = end + len(DAY_FILE_V2_BLOCKS_KEY)
+            return [Task.load_from_header(current_datetime, header, LazyTimeBlocks(text, blocks_start + header['blocks_at'], header)) for header in headers], 2
+    data = json.loads(text)
+    if isinstance(data, list):
+        return [Task.load_from_json(current_datetime, task_data) for task_data in data], 1
+    tasks = []
+    for header, pairs in zip(data['tasks'], data['blocks']):
+        task = Task(header['name'], current_datetime)
+        task.description = header['description']
+        task.time_blocks = [TimeBlock.from_timestamps(start, end) for start, end in pairs]
+        tasks.append(task)
+    return tasks, data['version']
+
+# Index over the time blocks of all tasks of a day, sorted by start. Closed
+# blocks overlapping a range can only start within max_length before it, so a
+# lookup bisects to that window instead of scanning every block of the day.
+class BlockIndex:
+    def __init__(self, tasks):
+        self.generation = None
+        self.open_entries = []
+        self.max_length = 0
+        closed_entries = []
+        for task in tasks:
+            for block in task.time_blocks:
+                if block.start is None:
+                    continue
+                if block.end is None:
+                    self.open_entries.append((block, task))
+                else:
+                    closed_entries.append((block, task))
+                    self.max_length = max(self.max_length, block.end - block.start)
+        closed_entries.sort(key=lambda entry: entry[0].start)
+        self.starts = [block.start for block, task in closed_entries]
+        self.entries = closed_entries
+
+    def add(self, block, task):
+        if block.end is None:
+            self.open_entries.append((block, task))
+            return
+        index = bisect.bisect_right(self.starts, block.start)
+        self.starts.insert(index, block.start)
+        self.entries.insert(index, (block, task))
+        self.max_length = max(self.max_length, block.end - block.start)
+
+    def discard(self, block):
+        if block.end is None:
+            self.open_entries = [entry for entry in self.open_entries if entry[0] is not block]
+            return
+        index = bisect.bisect_left(self.starts, block.start)
+        while index < len(self.entries) and self.entries[index][0] is not block:
+            index += 1
+        if index < len(self.entries):
+            del self.starts[index]
+            del self.entries[index]
+
+    def overlapping(self, start, end):
+        # Blocks only touching [start, end) do not overlap it; end None is open ended
+        first = bisect.bisect_left(self.starts, start - self.max_length)
+        last = len(self.starts) if end is None else bisect.bisect_left(self.starts, end)
+        found = [entry for entry in self.entries[first:last] if entry[0].end > start]
+        found += [entry for entry in self.open_entries if end is None or entry[0].start < end]
+        return found
+
+# Opt-in tracing (--trace FILE): every command appends one JSONL record with its
+# wall time, the time spent per phase (phases nest, so a phase includes the ones
+# it calls), the bytes written and the task and block counts of the day.
+# With --profile N the N slowest commands are also profiled with cProfile.
+# While TRACER is None a traced function costs one extra call and check.
+TRACER = None
+
+class Tracer:
+    def __init__(self, filepath, profile_count=0):
+        self.filepath = filepath
+        self.profile_count = profile_count
+        self.record = None
+        self.profiler = None
+        self.started = None
+        # (milliseconds, command, profiler) of the slowest commands, slowest first
+        self.slowest = []
+
+    def begin(self, command):
+        self.record = {'command': command, 'phases': {}, 'bytes_written': 0}
+        if self.profile_count > 0:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.started = time.perf_counter()
+
+    def add_phase(self, phase, seconds):
+        if self.record is not None:
+            phases = self.record['phases']
+            phases[phase] = phases.get(phase, 0) + seconds * 1000
+
+    def add_bytes(self, count):
+        if self.record is not None:
+            self.record['bytes_written'] += count
+
+    def end(self, tl):
+        milliseconds = (time.perf_counter() - self.started) * 1000
+        record = self.record
+        self.record = None
+        if record is None:
+            return
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.slowest.append((milliseconds, record['command'], self.profiler))
+            self.slowest.sort(key=lambda entry: -entry[0])
+            del self.slowest[self.profile_count:]
+            self.profiler = None
+        record['ms'] = round(milliseconds, 3)
+        record['phases'] = {phase: round(ms, 3) for phase, ms in record['phases'].items()}
+        record['time'] = time.time()
+        record['file'] = tl.file_name
+        record['tasks'] = len(tl.tasks)
+        record['blocks'] = sum(task.block_count() for task in tl.tasks)
+        with open(self.filepath, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        # the profiles are written as FILE.slowest-1.prof (the slowest), FILE.slowest-2.prof, ...
+        for rank, (milliseconds, command, profiler) in enumerate(self.slowest, 1):
+            profiler.dump_stats(f"{self.filepath}.slowest-{rank}.prof")
+        self.slowest = []
+
+def start_tracing(filepath, profile_count=0):
+    global TRACER
+    TRACER = Tracer(filepath, profile_count)
+
+def stop_tracing():
+    global TRACER
+    tracer = TRACER
+    TRACER = None
+    if tracer is not None:
+        tracer.close()
+
+def traced(phase):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if TRACER is None:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                TRACER.add_phase(phase, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+def default_file_mode():
+    # the mode open() gives new files; the umask can only be read by setting it
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+def write_file_atomically(filepath, raw):
+    # Write to a temp file in the same directory and rename it into place,
+    # so a crash leaves either the old or the new file but never a truncated one.
+    # Each write gets its own temp file, writers never write into each other's.
+    directory, name = os.path.split(filepath)
+    fd, tmp_filepath = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory or '.')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(raw)
+            file.flush()
+            os.fsync(file.fileno())
+            os.fchmod(file.fileno(), default_file_mode())
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        os.remove(tmp_filepath)
+        raise
+    if TRACER is not None:
+        TRACER.add_bytes(len(raw))
+
+LOCK_FILE_NAME = 'timelogger.lock'
+
+# Advisory lock on the timelogger.lock file of a directory, held while a day file
+# or a sidecar file of it is read and written, so processes working on the same
+# directory save one after another. One lock file serves all days of the
+# directory. The lock is not reentrant. Without fcntl (Windows) saves are not locked.
+class DirectoryLock:
+    def __init__(self, directory):
+        self.directory = directory
+        self.filepath = os.path.join(directory, LOCK_FILE_NAME)
+        self.file = None
+
+    def __enter__(self):
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        if not os.path.isdir(self.directory):
+            # nothing stored yet that could be written concurrently
+            return self
+        self.file = open(self.filepath, 'a')
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.file is not None:
+            import fcntl
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+def snapshot_hash_of(raw):
+    # hashlib loads OpenSSL, import it only once a day file is read or written
+    import hashlib
+    return hashlib.sha1(raw).hexdigest()
+
+def log_filepath_for(filepath):
+    return filepath + '.log'
+
+# Once the event log next to a day file grows beyond this many bytes, the next
+# save writes a fresh snapshot of the day and starts a new log.
+LOG_COMPACTION_THRESHOLD = 64 * 1024
+
+# The per task aggregates of a day, computed in one pass over the blocks of each
+# task against a single "now", so all views of one redraw agree with each other.
+class DaySummary:
+    def __init__(self, tl, now=None):
+        self.now = time.time() if now is None else now
+        self.date = tl.current_datetime
+        self.filepath = tl.filepath
+        self.rows = []
+        starts = []
+        ends = []
+        splits = []
+        for index, task in enumerate(tl.tasks):
+            summary = task.summary()
+            starts.append(summary['first_start'])
+            ends.append(summary['last_end'] if summary['open_start'] is None else None)
+            splits.append('-+>' if task.block_count() > 1 else '-->')
+            self.rows.append({
+                'id': index,
+                'name': task.name,
+                'hours': summary_hours(summary, self.now),
+                'time_range': None,
+                'active': task.is_active(),
+                'unpaid': task.is_unpaid(),
+            })
+        # the time ranges of all rows in one go against the clock of the day
+        for row, time_range in zip(self.rows, tl.clock.format_blocks(starts, ends, splits)):
+            row['time_range'] = time_range
+        self.total_hours = sum(row['hours'] for row in self.rows)
+        self.working_hours = sum(row['hours'] for row in self.rows if not row['unpaid'])
+
+    def hours_since_midnight(self):
+        return (self.now - DayClock.for_timestamp(self.now).midnight) / 3600
+
+    def to_json(self):
+        return {
+            'date': self.date.isoformat(),
+            'file': self.filepath,
+            'now': self.now,
+            'total_hours': self.total_hours,
+            'working_hours': self.working_hours,
+            'tasks': self.rows,
+        }
+
+# TimeLogger attributes that belong to the logger, all others describe its current day
+DAY_CACHE_SHARED = {'save_stats', 'written_status', 'defer_normalization', 'storage', 'day_cache', 'undo_budget', 'conflicts'}
+
+DAY_CACHE_SIZE = 16
+
+# Least recently used days of a TimeLogger as returned by day_state(), with their
+# undo journals and unsaved changes, the most recently used last. Filled by day
+# switches and by a background thread prefetching the neighbouring days.
+class DayCache:
+    def __init__(self, size=DAY_CACHE_SIZE):
+        import threading
+        self.size = size
+        self.states = {}
+        self.lock = threading.Lock()
+        self.loading = set()
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, filepath):
+        with self.lock:
+            state = self.states.pop(filepath, None)
+            if state is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return state
+
+    def put(self, filepath, state):
+        # returns the states evicted to stay within size
+        with self.lock:
+            self.states.pop(filepath, None)
+            self.states[filepath] = state
+            evicted = []
+            while len(self.states) > self.size:
+                oldest = next(iter(self.states))
+                evicted.append(self.states.pop(oldest))
+            return evicted
+
+    def prefetch(self, filepaths):
+        for filepath in filepaths:
+            with self.lock:
+                if filepath in self.states or filepath in self.loading:
+                    continue
+                self.loading.add(filepath)
+            try:
+                state = TimeLogger(filepath).day_state()
+            except (OSError, ValueError):
+                state = None
+            with self.lock:
+                self.loading.discard(filepath)
+                # never push out a day with unsaved changes, only clean ones
+                if state is None or filepath in self.states:
+                    continue
+                if len(self.states) >= self.size:
+                    oldest = next(iter(self.states))
+                    if TimeLogger.from_day_state(self.states[oldest]).is_dirty():
+                        continue
+                    del self.states[oldest]
+                self.states[filepath] = state
+
 class TimeLogger:
-    def __init__(self, filepath):
+    def __init__(self, filepath, storage=None, undo_budget=UNDO_BUDGET):
+        self.save_stats = {'performed': 0, 'skipped': 0}
+        self.written_status = None
+        self.defer_normalization = False
+        # None keeps the day in the JSON day file (with its event log) at filepath,
+        # otherwise a storage like SqliteStorage loads and saves the day of filepath
+        self.storage = storage
+        self.day_cache = None
+        self.undo_budget = undo_budget
+        # messages about changes of another process that undo or redo could not take back
+        self.conflicts = []
         self.load_file(filepath)
 
     def load_file(self, filepath):
@@ -360,48 +1273,354 @@ class TimeLogger:
         self.file_name = path[-1]
         self.parrent_dir = path[:-1]
         self.current_datetime = datetime.strptime(self.file_name.split('_')[0], '%Y-%m-%d').date()
-        if os.path.isfile(self.filepath):
+        self.clock = day_clock(self.current_datetime)
+        self.log_filepath = log_filepath_for(self.filepath)
+        self.pending_events = []
+        self.needs_snapshot = False
+        self.snapshot_hash = None
+        self.log_size = 0
+        self.generation = 0
+        self.saved_generation = 0
+        self.block_index = None
+        self.normalization_pending = False
+        self.journal = UndoJournal(self.undo_budget)
+        # taken before reading, a save in between is detected as a change later on
+        self.disk_signature = self.read_disk_signature()
+        if self.storage is not None:
+            self.tasks = self.storage.load_tasks(self.current_datetime)
+        elif os.path.isfile(self.filepath):
             self.load_tasks_from_file()
-        self.history = []
-        self.redo_history = []
+            self.replay_log()
+        self.pending_events = []
+        self.saved_generation = self.generation
+        self.indexed_entries = SearchIndex.entries_of(self.tasks)
+        self.vocabulary_names = sorted({task.name for task in self.tasks})
+
+    # task_ids maps each task name to its position (= id) in tasks, so lookups by
+    # name or id are O(1). It is rebuilt whenever tasks is reassigned or reordered.
+    @property
+    def tasks(self):
+        return self._tasks
+
+    @tasks.setter
+    def tasks(self, tasks):
+        self._tasks = tasks
+        self.index_tasks()
+        self.block_index = None
+
+    def index_tasks(self):
+        self.task_ids = {}
+        for index, task in enumerate(self._tasks):
+            self.task_ids.setdefault(task.name, index)
+
+    def add_task(self, task):
+        self._tasks.append(task)
+        self.task_ids.setdefault(task.name, len(self._tasks) - 1)
+
+    def delete_task(self, task_id):
+        del self._tasks[task_id]
+        self.index_tasks()
 
     def keep_history(self):
-        self.redo_history.clear()
-        self.history.append(copy.deepcopy(self.tasks))
+        self.journal.begin(self.tasks)
 
+    def touch(self, task):
+        self.journal.touch(task)
+
+    @traced('command')
     def undo(self):
-        if len(self.history) != 0:
-            self.redo_history.append(copy.deepcopy(self.tasks))
-            self.tasks[:] = self.history.pop()
+        if self.journal.can_undo():
+            self.restore_and_record(self.journal.undo(self.tasks))
         else:
             print('Noting to undo!')
 
+    @traced('command')
     def redo(self):
-        if len(self.redo_history) != 0:
-            self.history.append(copy.deepcopy(self.tasks))
-            self.tasks[:] = self.redo_history.pop()
+        if self.journal.can_redo():
+            self.restore_and_record(self.journal.redo(self.tasks))
         else:
             print('Noting to redo!')
 
-    def load_tasks_from_file(self):
-        with open(self.filepath, 'r') as file:
-            data = json.load(file)
-            for task_data in data:
-                task = Task.load_from_json(self.current_datetime, task_data)
-                self.tasks.append(task)
+    def restore_and_record(self, events):
+        # undo and redo are saved as events, so a rebase applies them again on
+        # top of the changes of another process
+        for op, fields in events:
+            self.apply_event(dict(fields, op=op))
+            self.record(op, **fields)
+
+    def restore_task(self, event):
+        # Turns the task named event['name'] (None: a task to create) into the one
+        # named event['to'] (None: remove it), taking out and putting back the
+        # blocks the command changed; what another process changed meanwhile stays
+        name = event['name']
+        task = self.get_task(name) if name is not None and self.task_exists(name) else None
+        self.block_index = None
+        if task is None:
+            if event['to'] is None:
+                return
+            if name is not None:
+                self.conflicts.append(f"'{name}' was removed by another process, '{event['to']}' was created again")
+            if not self.task_exists(event['to']):
+                self.create_task(event['to'])
+            task = self.get_task(event['to'])
+        kept = 0
+        for start, end in event['remove']:
+            if not task.remove_time_block(start, end):
+                kept += 1
+        if kept > 0:
+            self.conflicts.append(f"'{task.name}': {kept} block(s) changed by another process were kept")
+        if event['to'] is None:
+            if len(task.time_blocks) == 0:
+                self.delete_task(self.find_task_id(task.name))
+            elif kept == 0:
+                self.conflicts.append(f"'{task.name}' was kept, another process added blocks to it")
+            return
+        if task.name != event['to']:
+            if self.task_exists(event['to']):
+                self.conflicts.append(f"'{task.name}' was not renamed back to '{event['to']}', another task has that name")
+            else:
+                task.name = event['to']
+                self.index_tasks()
+        task.description = event['description']
+        touching = False
+        for start, end in event['add']:
+            touching = task.insert_time_block(TimeBlock.from_timestamps(start, end)) or touching
+        if touching:
+            # put back next to blocks another process added
+            task.merge_touching_time_blocks()
+
+    def record(self, op, **fields):
+        fields['op'] = op
+        self.pending_events.append(fields)
+        self.generation += 1
 
+    def is_dirty(self):
+        # tasks assigned directly to a day without a file are saved as well
+        return self.generation != self.saved_generation or (self.storage is None and self.snapshot_hash is None and len(self.tasks) > 0)
+
+    def load_tasks_from_file(self):
+        with open(self.filepath, 'rb') as file:
+            raw = file.read()
+        self.snapshot_hash = snapshot_hash_of(raw)
+        self.tasks, version = decode_day_file(raw.decode('utf-8'), self.current_datetime)
+        # migrate older files to the current format with the next save
+        if version < 2:
+            self.needs_snapshot = True
+
+    def replay_log(self):
+        if not os.path.isfile(self.log_filepath):
+            return
+        with open(self.log_filepath, 'r') as file:
+            lines = file.readlines()
+        self.log_size = sum(len(line) for line in lines)
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            header = {}
+        # A log written against an older snapshot was already compacted into the current one
+        if header.get('snapshot') != self.snapshot_hash:
+            self.needs_snapshot = True
+            return
+        for line in lines[1:]:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # Torn write at the end of the log, rewrite a clean snapshot on next save
+                self.needs_snapshot = True
+                break
+            self.apply_event(event)
+
+    def apply_event(self, event):
+        op = event['op']
+        if op == 'start':
+            if not self.task_exists(event['name']):
+                self.create_task(event['name'])
+            self.get_task(event['name']).start(event['at'])
+            # started and stopped here without a record, which would move the block index along
+            self.block_index = None
+        elif op == 'stop':
+            if self.task_exists(event['name']):
+                self.get_task(event['name']).stop(event['end'])
+                self.block_index = None
+        elif op == 'add_block':
+            self.add_block_to_task(event['name'], TimeBlock.from_timestamps(event['start'], event['end']))
+        elif op == 'rename':
+            self.rename_task(event['name'], event['to'])
+        elif op == 'merge':
+            if self.all_tasks_exist([event['name'], event['other']]):
+                self.merge_tasks(event['name'], event['other'])
+                # the blocks as merged when recorded, merging an active task depends on the time
+                self.get_task(event['name']).restore((event['name'], self.get_task(event['name']).description, event['time_blocks']))
+        elif op == 'remove':
+            if self.task_exists(event['name']):
+                self.delete_task(self.find_task_id(event['name']))
+        elif op == 'restore':
+            self.restore_task(event)
+        elif op == 'order':
+            # tasks another process added keep their order after the named ones
+            positions = {name: position for position, name in enumerate(event['names'])}
+            self.tasks[:] = sorted(self.tasks, key=lambda task: positions.get(task.name, len(positions)))
+            self.index_tasks()
+        elif op == 'normalize':
+            self.normalize_tasks()
+
+    @traced('save')
     def save_tasks_to_file(self):
+        self.flush_normalization()
+        if not self.is_dirty():
+            self.save_stats['skipped'] += 1
+            return
+        self.save_stats['performed'] += 1
         if not os.path.exists('/'.join(self.parrent_dir)):
             os.makedirs('/'.join(self.parrent_dir))
-        data = [task.get_json() for task in self.tasks]
-        with open(self.filepath, 'w') as file:
-            json.dump(data, file)
+        # the day and the sidecar files adjusted by it are read and written under one lock
+        with DirectoryLock('/'.join(self.parrent_dir)):
+            if self.storage is not None:
+                # the search index and vocabulary files cover the JSON day files only
+                self.save_to_storage()
+            else:
+                self.save_to_day_file()
+                self.update_search_index()
+                self.update_vocabulary()
+            self.update_status_file()
+        self.pending_events = []
+        self.saved_generation = self.generation
+
+    def save_to_day_file(self):
+        # called with the DirectoryLock of the day's directory held
+        if self.read_disk_signature() != self.disk_signature:
+            self.rebase()
+        if self.needs_snapshot or self.snapshot_hash is None or self.log_size > LOG_COMPACTION_THRESHOLD:
+            self.write_snapshot()
+        elif len(self.pending_events) > 0:
+            self.append_to_log(self.pending_events)
+        self.disk_signature = self.read_disk_signature()
+
+    def save_to_storage(self):
+        # the transaction holds the write lock of the database from the comparison
+        # of the day's version to the end of the save
+        with self.storage.transaction():
+            if self.read_disk_signature() != self.disk_signature:
+                self.rebase()
+            self.storage.write_day(self.current_datetime, self.tasks)
+        self.disk_signature = self.read_disk_signature()
+
+    def update_search_index(self):
+        # only names and descriptions are indexed, most saves change neither
+        entries = SearchIndex.entries_of(self.tasks)
+        if entries == self.indexed_entries:
+            return
+        directory = '/'.join(self.parrent_dir)
+        if SearchIndex.exists(directory):
+            SearchIndex.append_day(directory, self.current_datetime, self.file_name, entries)
+        self.indexed_entries = entries
+
+    def update_vocabulary(self):
+        # only saves changing the names of the day count
+        names = sorted({task.name for task in self.tasks})
+        if names == self.vocabulary_names:
+            return
+        directory = '/'.join(self.parrent_dir)
+        if Vocabulary.exists(directory):
+            Vocabulary.append_day(directory, self.current_datetime, names)
+        self.vocabulary_names = names
+
+    def read_disk_signature(self):
+        # a save replaces the day file (new inode) or appends to the log (new size),
+        # a save to a storage counts up the version of the day
+        if self.storage is not None:
+            return self.storage.day_version(self.current_datetime)
+        signature = []
+        for filepath in [self.filepath, self.log_filepath]:
+            try:
+                stat = os.stat(filepath)
+                signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def rebase(self):
+        # Another process saved the day since it was loaded here: load its version
+        # and apply the events of the changes made here since the last save on top
+        pending_events = self.pending_events
+        self.reload()
+        rebased_events = []
+        for event in pending_events:
+            if event['op'] == 'merge':
+                # merged again, keeping the blocks the other process added to the
+                # kept task; the new event records the merged blocks
+                if self.all_tasks_exist([event['name'], event['other']]):
+                    self.merge_tasks(event['name'], event['other'])
+                    rebased_events.append(self.pending_events[-1])
+                continue
+            if event['op'] == 'start':
+                # one task runs at a time, stop a task the other process started
+                for task in self.tasks:
+                    if task.is_active() and task.name != event['name']:
+                        rebased_events.append({'name': task.name, 'end': task.stop(event['at']), 'op': 'stop'})
+                        self.block_index = None
+            self.apply_event(event)
+            rebased_events.append(event)
+        # apply_event recorded some of the events again, the originals are saved
+        self.pending_events = rebased_events
+        self.generation += 1
+
+    def reload_if_changed(self):
+        # picks up the saves of other processes while there is nothing to save here
+        if self.is_dirty() or self.read_disk_signature() == self.disk_signature:
+            return False
+        self.reload()
+        return True
+
+    def reload(self):
+        # the sealed journal refers to tasks by name, it is kept for the reloaded tasks
+        self.journal.seal(self.tasks)
+        journal = self.journal
+        self.load_file(self.filepath)
+        self.journal = journal
+
+    def pop_conflicts(self):
+        conflicts = self.conflicts
+        self.conflicts = []
+        return conflicts
+
+    def update_status_file(self):
+        # keeps the active task of today in a tiny sidecar read by --status
+        if self.current_datetime != date.today():
+            return
+        task = self.get_current_task()
+        status = {'date': self.current_datetime.isoformat(), 'task': None, 'start': None}
+        if task is not None:
+            status['task'] = task.name
+            status['start'] = task.summary()['open_start']
+        if status != self.written_status:
+            write_file_atomically(os.path.join('/'.join(self.parrent_dir), STATUS_FILE_NAME), json.dumps(status))
+            self.written_status = status
+
+    def write_snapshot(self):
+        raw = encode_day_file(self.tasks)
+        write_file_atomically(self.filepath, raw)
+        self.snapshot_hash = snapshot_hash_of(raw.encode())
+        if os.path.isfile(self.log_filepath):
+            os.remove(self.log_filepath)
+        self.log_size = 0
+        self.needs_snapshot = False
+
+    def append_to_log(self, events):
+        lines = [json.dumps(event) + '\n' for event in events]
+        if self.log_size == 0:
+            lines.insert(0, json.dumps({'snapshot': self.snapshot_hash}) + '\n')
+        raw = ''.join(lines)
+        with open(self.log_filepath, 'a') as file:
+            file.write(raw)
+            file.flush()
+            os.fsync(file.fileno())
+        self.log_size += len(raw)
+        if TRACER is not None:
+            TRACER.add_bytes(len(raw))
 
     def task_exists(self,task_name):
-        for task in self.tasks:
-            if task.name == task_name:
-                return True
-        return False
+        return task_name in self.task_ids
 
     def all_tasks_exist(self,task_refs):
         for task_ref in task_refs:
@@ -410,19 +1629,25 @@ class TimeLogger:
         return True
 
     def find_task_id(self,task_name):
-        for index, task in enumerate(self.tasks):
-            if task.name == task_name:
-                return index
+        return self.task_ids.get(task_name)
 
     def rename_task(self,old_name,new_name):
         if self.task_exists(old_name):
-            self.tasks[self.find_task_id(old_name)].name = new_name
+            task = self.tasks[self.find_task_id(old_name)]
+            self.touch(task)
+            task.name = new_name
+            self.index_tasks()
+            self.record('rename', name=old_name, to=new_name)
 
     def merge_tasks(self,task_to_keep,task_to_consume):
         keep_id = self.find_task_id(task_to_keep)
         consume_id = self.find_task_id(task_to_consume)
+        self.touch(self.tasks[keep_id])
+        self.touch(self.tasks[consume_id])
         self.tasks[keep_id].merge_with(self.tasks[consume_id])
-        del self.tasks[consume_id]
+        self.delete_task(consume_id)
+        self.record('merge', name=task_to_keep, other=task_to_consume,
+                    time_blocks=[[block.start, block.end] for block in self.get_task(task_to_keep).time_blocks])
 
     def get_current_task(self):
         for task in self.tasks:
@@ -432,94 +1657,120 @@ class TimeLogger:
 
     def stop_current_task(self):
         for task in self.tasks:
-            task.stop()
+            if task.is_active():
+                self.touch(task)
+                self.record('stop', name=task.name, end=task.stop())
 
     def create_task(self,task_name):
-        self.tasks.append(Task(task_name, self.current_datetime))
+        self.add_task(Task(task_name, self.current_datetime))
 
     def start_task(self,task_name):
-        for task in self.tasks:
-            if task.name == task_name:
-                task.start()
-                return
+        if self.task_exists(task_name):
+            task = self.get_task(task_name)
+            self.touch(task)
+            self.start_and_record(task)
+            return
         new_task = Task(task_name, self.current_datetime)
-        self.tasks.append(new_task)
-        self.tasks[-1].start()
+        self.add_task(new_task)
+        self.start_and_record(new_task)
+
+    def start_and_record(self, task):
+        if not task.is_active():
+            task.start()
+            self.record('start', name=task.name, at=task.time_blocks[-1].start)
 
     def format_hours(self,hours):
-        h = int(hours)
-        m = int((hours - int(hours)) * 60)
-        if h == 0:
-            return f"{m}m"
-        else:
-            return f"{h}h+{m}m"
+        return format_hours(hours)
 
     def format_hours_as_time_sting(self,hours):
         h = int(hours)
         m = int((hours - int(hours)) * 60)
         return f"{h}:{m:02d}"
 
-    def show_task_summary(self):
+    def snapshot(self, now=None):
+        return DaySummary(self, now)
+
+    def show_task_summary(self, snapshot=None):
+        if snapshot is None:
+            snapshot = self.snapshot()
+        for line in self.summary_header_lines(snapshot) + self.summary_row_lines(snapshot):
+            print(line)
+
+    def summary_header_lines(self, snapshot):
         correction_offset = 0.00001
-        h_since_midnight = hours_since_midnight() + correction_offset 
+        h_since_midnight = snapshot.hours_since_midnight() + correction_offset
         workday_hours = 8
-        total_logged_time_raw = sum(task.get_total_time_spent() for task in self.tasks)
-        total_logged_time = self.format_hours(total_logged_time_raw)
-        visible_tasks = [task for task in self.tasks if not task.is_unpaid()]
-        total_working_time = self.format_hours(sum(task.get_total_time_spent() for task in visible_tasks))
-        done_achieved_at = self.format_hours_as_time_sting(h_since_midnight + (workday_hours - total_logged_time_raw))
-        print(f"Total logged time: {total_logged_time}")
+        total_logged_time = self.format_hours(snapshot.total_hours)
+        total_working_time = self.format_hours(snapshot.working_hours)
+        done_achieved_at = self.format_hours_as_time_sting(h_since_midnight + (workday_hours - snapshot.total_hours))
+        lines = [f"Total logged time: {total_logged_time}"]
         if not total_logged_time == total_working_time:
-            print(f"Total working time: {total_working_time}")
-        print(f"no need to work after: {done_achieved_at}")
-        print()
-        for index, task in enumerate(self.tasks):
-            total_time = self.format_hours(task.get_total_time_spent()).rjust(7,'.')
-            task_time_range = task.get_task_time_range()
-            pointer = '>' if task.is_active() else '.'
-            fill = '..' if task.is_active() else ''
-            print(f"{index:02d} {pointer} {total_time} {task_time_range}{fill} {pointer} {pointer} {pointer} {task.name}")
-
-    def show_task_percentages(self):
-        visible_tasks = [task for task in self.tasks if not task.is_unpaid()]
-        total_time = sum(task.get_total_time_spent() for task in visible_tasks)
+            lines.append(f"Total working time: {total_working_time}")
+        lines.append(f"no need to work after: {done_achieved_at}")
+        lines.append("")
+        return lines
+
+    def summary_row_lines(self, snapshot):
+        lines = []
+        for row in snapshot.rows:
+            total_time = self.format_hours(row['hours']).rjust(7,'.')
+            pointer = '>' if row['active'] else '.'
+            fill = '..' if row['active'] else ''
+            lines.append(f"{row['id']:02d} {pointer} {total_time} {row['time_range']}{fill} {pointer} {pointer} {pointer} {row['name']}")
+        return lines
+
+    def get_summary(self, snapshot=None):
+        if snapshot is None:
+            snapshot = self.snapshot()
+        return snapshot.to_json()
+
+    def show_task_percentages(self, snapshot=None):
+        if snapshot is None:
+            snapshot = self.snapshot()
+        lines = self.percentage_lines(snapshot)
+        # the line of the tasks is left open, like the summary printed it before
+        print('\n'.join(lines), end='\n' if len(lines) > 1 else '')
+
+    def percentage_lines(self, snapshot):
+        visible_rows = [row for row in snapshot.rows if not row['unpaid']]
+        if not visible_rows:
+            return []
         rounded_percentages = []
-        for task in visible_tasks:
+        for row in visible_rows:
             task_percentage = 0
-            try:
-                task_percentage = (task.get_total_time_spent() / total_time) * 100
-            except:
-                pass
+            if snapshot.working_hours != 0:
+                task_percentage = (row['hours'] / snapshot.working_hours) * 100
             rounded_percentage = round(task_percentage)
             rounded_percentages.append(rounded_percentage)
         # Adjust the last percentage to ensure the sum is 100
         correction = 100 - sum(rounded_percentages)
-        if rounded_percentages:
-            rounded_percentages[-1] += correction
-        # Print the task names and percentages
-        for i, task in enumerate(visible_tasks):
-                print(f"{task.name} {rounded_percentages[i]}%;", end=" ")
-        if visible_tasks and correction != 0:
-            print()
-            print()
-            print(f"Percent correction on last task to ensure sum of 100%: {correction}%")
+        rounded_percentages[-1] += correction
+        lines = [''.join(f"{row['name']} {rounded_percentages[i]}%; " for i, row in enumerate(visible_rows))]
+        if correction != 0:
+            lines += ['', f"Percent correction on last task to ensure sum of 100%: {correction}%"]
+        return lines
 
     def task_id_to_name(self,possible_id):
         if self.task_exists(possible_id):
             return possible_id
         if possible_id.isdigit() and int(possible_id)>=0 and int(possible_id)<len(self.tasks):
+            # ids are positions in the normalized order, normalizing keeps the number of tasks
+            self.flush_normalization()
             return self.tasks[int(possible_id)].name
         return possible_id
 
     # TODO test
+    @traced('command')
     def command_remove(self,command):
         if self.verbose:
             print("command_remove")
         task_name = self.task_id_to_name(' '.join(command.split(' ')[1:]))
         if self.task_exists(task_name):
-            del self.tasks[self.find_task_id(task_name)]
+            self.delete_task(self.find_task_id(task_name))
+            self.record('remove', name=task_name)
 
     # TODO test
+    @traced('command')
     def command_stop(self):
         if self.verbose:
             print("command_stop")
@@ -547,6 +1798,7 @@ class TimeLogger:
         print("")
 
 
+    @traced('parse')
     def convert_to_task_refs(self,command):
         return [self.task_id_to_name(task_ref) for task_ref in command.split('=')]
 
@@ -556,11 +1808,39 @@ class TimeLogger:
         return None
 
     # TODO test
+    @traced('normalize')
     def normalize_tasks(self):
+        # only a merge or a new order is recorded, so commands changing nothing stay unsaved
+        index = self.valid_block_index()
+        changed = False
         for task in self.tasks:
-            task.merge_touching_time_blocks()
-        self.tasks = sorted(self.tasks)
-
+            if task.has_mergeable_time_blocks():
+                self.touch(task)
+                merged_blocks = list(task.time_blocks)
+                task.merge_touching_time_blocks()
+                if index is not None:
+                    for block in merged_blocks:
+                        index.discard(block)
+                    for block in task.time_blocks:
+                        index.add(block, task)
+                changed = True
+        tasks = sorted(self.tasks)
+        if any(task is not previous for task, previous in zip(tasks, self.tasks)):
+            # reordered in place, the block index does not depend on the order
+            self.tasks[:] = tasks
+            self.index_tasks()
+            changed = True
+        if changed:
+            self.record('normalize')
+            if index is not None:
+                index.generation = self.generation
+
+    def flush_normalization(self):
+        if self.normalization_pending:
+            self.normalization_pending = False
+            self.normalize_tasks()
+
+    @traced('command')
     def command_create_rename_merge(self,command):
         if self.verbose:
             print("command_create_rename_merge")
@@ -574,7 +1854,11 @@ class TimeLogger:
         elif self.all_tasks_exist(task_refs[:-1]) and not self.task_exists(task_refs[-1]):
             self.sub_command_merge(task_refs[:-1])
             self.sub_command_rename(task_refs)
-        self.normalize_tasks()
+        if self.defer_normalization:
+            # batches normalize once, before ids are resolved or the day is saved
+            self.normalization_pending = True
+        else:
+            self.normalize_tasks()
 
     def sub_command_start_new_or_existing_task(self,task_ref):
         if self.verbose:
@@ -582,44 +1866,1146 @@ class TimeLogger:
         last_active_task = self.get_current_task()
         if not self.task_exists(task_ref):
             self.create_task(task_ref)
-        self.get_task(task_ref).start()
+        self.touch(self.get_task(task_ref))
+        self.start_and_record(self.get_task(task_ref))
         if last_active_task is not None and last_active_task is not self.get_task(task_ref):
-            last_active_task.stop()
+            # switch tasks at one instant, the stopped block ends where the started one begins
+            self.touch(last_active_task)
+            end = last_active_task.stop(self.get_task(task_ref).time_blocks[-1].start)
+            self.record('stop', name=last_active_task.name, end=end)
 
     def sub_command_time_block_to_new_or_existing_task(self,task_ref, time_range):
         if self.verbose:
             print("sub_command_time_block_to_new_or_existing_task")
-        for task in self.tasks:
-            task.remove_conflicts_with(TimeBlock(self.current_datetime, time_range))
+        start, end = self.clock.parse_range(time_range)
+        self.add_block_to_task(task_ref, TimeBlock.from_timestamps(start, end))
+
+    # The block index is valid for the generation it was built or last updated
+    # for; commands updating it (back-fills, normalization) move it along.
+    def valid_block_index(self):
+        if self.block_index is None or self.block_index.generation != self.generation:
+            return None
+        return self.block_index
+
+    def get_block_index(self):
+        if self.valid_block_index() is None:
+            self.block_index = BlockIndex(self.tasks)
+            self.block_index.generation = self.generation
+        return self.block_index
+
+    @traced('conflicts')
+    def add_block_to_task(self, task_ref, new_block):
+        index = self.get_block_index()
+        if new_block.start is not None:
+            for block, task in index.overlapping(new_block.start, new_block.end):
+                self.touch(task)
+                index.discard(block)
+                for remaining_block in task.cut_out(block, new_block):
+                    index.add(remaining_block, task)
         if not self.task_exists(task_ref):
             self.create_task(task_ref)
-        self.get_task(task_ref).add_time_block(time_range)
+        task = self.get_task(task_ref)
+        self.touch(task)
+        if new_block.start is not None:
+            task.insert_time_block(new_block)
+            index.add(new_block, task)
+        self.record('add_block', name=task_ref, start=new_block.start, end=new_block.end)
+        # the index was kept up to date with the edits above
+        index.generation = self.generation
 
     def sub_command_merge(self,task_refs):
         if self.verbose:
             print("sub_command_merge")
         for task_ref in task_refs[1:]:
-            self.merge_tasks(task_refs[0],task_ref)
+            # 'a=a' or 'a=<id of a>' names the kept task itself, nothing to merge
+            if task_ref != task_refs[0]:
+                self.merge_tasks(task_refs[0],task_ref)
 
     def sub_command_rename(self,task_refs):
         if self.verbose:
             print("sub_command_rename")
         self.rename_task(task_refs[0],task_refs[-1])
 
+    @traced('load')
     def command_next_day(self):
-        previous_date = self.current_datetime + relativedelta(days=1)
-        path_elements = self.parrent_dir + [previous_date.strftime('%Y-%m-%d_%A.json')]
-        path = '/'.join(self.parrent_dir)+'/'
-        filepath = '/'.join(path_elements)
-        self.load_file(filepath)
+        self.switch_day(self.day_filepath(1))
 
+    @traced('load')
     def command_prev_day(self):
-        previous_date = self.current_datetime - relativedelta(days=1)
-        path_elements = self.parrent_dir + [previous_date.strftime('%Y-%m-%d_%A.json')]
-        path = '/'.join(self.parrent_dir)+'/'
-        filepath = '/'.join(path_elements)
-        self.load_file(filepath)
-        
+        self.switch_day(self.day_filepath(-1))
+
+    def day_filepath(self, days):
+        day = self.current_datetime + timedelta(days=days)
+        return '/'.join(self.parrent_dir + [day.strftime('%Y-%m-%d_%A.json')])
+
+    def day_state(self):
+        return {key: value for key, value in vars(self).items() if key not in DAY_CACHE_SHARED}
+
+    @staticmethod
+    def from_day_state(state, storage=None):
+        tl = TimeLogger.__new__(TimeLogger)
+        tl.save_stats = {'performed': 0, 'skipped': 0}
+        tl.written_status = None
+        tl.defer_normalization = False
+        tl.storage = storage
+        tl.day_cache = None
+        tl.undo_budget = UNDO_BUDGET
+        tl.conflicts = []
+        vars(tl).update(state)
+        return tl
+
+    def switch_day(self, filepath):
+        # The day left is kept in the day cache with its undo journal and unsaved
+        # changes; a cached day is used again unless another process saved it
+        if self.day_cache is None:
+            self.day_cache = DayCache()
+        for state in self.day_cache.put(self.filepath, self.day_state()):
+            # evicted days with unsaved changes (batches save before switching) are saved
+            TimeLogger.from_day_state(state, self.storage).save_tasks_to_file()
+        state = self.day_cache.take(filepath)
+        if state is not None:
+            cached = TimeLogger.from_day_state(state, self.storage)
+            # a day another process saved meanwhile is loaded again, keeping its journal
+            if cached.reload_if_changed():
+                state = cached.day_state()
+        if state is not None:
+            vars(self).update(state)
+        else:
+            self.load_file(filepath)
+        self.prefetch_neighbours()
+
+    def prefetch_neighbours(self):
+        # loads the previous and next day in the background, so paging is instant
+        if self.storage is not None:
+            # connections of a storage belong to the thread that opened them
+            return None
+        if self.day_cache is None:
+            self.day_cache = DayCache()
+        import threading
+        filepaths = [self.day_filepath(1), self.day_filepath(-1)]
+        thread = threading.Thread(target=self.day_cache.prefetch, args=(filepaths,), daemon=True)
+        thread.start()
+        return thread
+
+DAY_FILE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})_.*\.json$')
+
+# Below this many day files a report is summarized in-process, as starting
+# worker processes would cost more than parsing the files
+REPORT_POOL_THRESHOLD = 64
+
+def find_day_files(directory, first_day=None, last_day=None):
+    day_files = []
+    if not os.path.isdir(directory):
+        return day_files
+    for file_name in os.listdir(directory):
+        match = DAY_FILE_PATTERN.match(file_name)
+        if match is None:
+            continue
+        try:
+            day = datetime.strptime(match.group(1), '%Y-%m-%d').date()
+        except ValueError:
+            continue
+        if (first_day is None or day >= first_day) and (last_day is None or day <= last_day):
+            day_files.append((day, os.path.join(directory, file_name)))
+    return sorted(day_files)
+
+def summarize_tasks(tasks):
+    # Task.summary() per task name, tasks sharing a name are combined
+    task_summaries = {}
+    for task in tasks:
+        task_summary = task.summary()
+        summary = task_summaries.get(task.name)
+        if summary is None:
+            task_summaries[task.name] = task_summary
+            continue
+        summary['hours'] += task_summary['hours']
+        summary['open_start'] = summary['open_start'] if task_summary['open_start'] is None else task_summary['open_start']
+        for key, pick in [('first_start', min), ('last_end', max)]:
+            values = [value for value in [summary[key], task_summary[key]] if value is not None]
+            summary[key] = pick(values) if values else None
+    return task_summaries
+
+def summary_hours(task_summary, now):
+    if task_summary['open_start'] is None:
+        return task_summary['hours']
+    return task_summary['hours'] + (now - task_summary['open_start']) / 3600
+
+def summarize_day_file(filepath):
+    tl = TimeLogger(filepath)
+    return {'date': tl.current_datetime.isoformat(), 'tasks': summarize_tasks(tl.tasks)}
+
+def stat_signature(filepath):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+# Sidecar file in the day file directory holding summarize_day_file() results,
+# keyed by file name and the mtime and size of the day file and its event log.
+# Entries are recomputed only when one of those files changed.
+class SummaryCache:
+    def __init__(self, directory):
+        self.filepath = os.path.join(directory, 'summary_cache.json')
+        self.entries = {}
+        self.changed = False
+        if os.path.isfile(self.filepath):
+            try:
+                with open(self.filepath, 'r') as file:
+                    self.entries = json.load(file)['days']
+            except (ValueError, KeyError):
+                self.entries = {}
+
+    @staticmethod
+    def signature(filepath):
+        return [stat_signature(filepath), stat_signature(log_filepath_for(filepath))]
+
+    def lookup(self, filepath, signature):
+        entry = self.entries.get(os.path.basename(filepath))
+        if entry is not None and entry['signature'] == signature:
+            return entry['summary']
+        return None
+
+    def store(self, filepath, signature, summary):
+        self.entries[os.path.basename(filepath)] = {'signature': signature, 'summary': summary}
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        try:
+            write_file_atomically(self.filepath, json.dumps({'version': 1, 'days': self.entries}))
+            self.changed = False
+        except OSError:
+            # a read only history can still be summarized, just not cached
+            pass
+
+    def day_summaries(self, day_files, processes=None):
+        summaries = {}
+        missing = []
+        for day, path in day_files:
+            signature = SummaryCache.signature(path)
+            summary = self.lookup(path, signature)
+            if summary is None:
+                missing.append((path, signature))
+            else:
+                summaries[path] = summary
+        for (path, signature), summary in zip(missing, summarize_day_files([path for path, signature in missing], processes)):
+            self.store(path, signature, summary)
+            summaries[path] = summary
+        self.save()
+        return [summaries[path] for day, path in day_files]
+
+# Sidecar files built from all days (search index, vocabulary) are kept as a
+# snapshot plus a log next to it with one JSON line per day saved since, so a
+# save appends the state of its own day instead of rewriting the whole file.
+# A line holds the full state of its day, which makes replaying it twice
+# harmless when a crash left the log behind after writing a new snapshot.
+def read_sidecar_log(filepath):
+    updates = []
+    try:
+        with open(log_filepath_for(filepath), 'r') as file:
+            lines = file.readlines()
+    except OSError:
+        return updates
+    for line in lines:
+        try:
+            updates.append(json.loads(line))
+        except ValueError:
+            # torn write at the end of the log
+            break
+    return updates
+
+def append_to_sidecar_log(filepath, update):
+    # returns the size of the log, the caller compacts it into a snapshot once it is too large
+    raw = json.dumps(update, separators=(',', ':')) + '\n'
+    with open(log_filepath_for(filepath), 'a') as file:
+        file.write(raw)
+        file.flush()
+        os.fsync(file.fileno())
+        size = file.tell()
+    if TRACER is not None:
+        TRACER.add_bytes(len(raw))
+    return size
+
+def write_sidecar_snapshot(filepath, raw):
+    # the snapshot takes in the log
+    write_file_atomically(filepath, raw)
+    if os.path.isfile(log_filepath_for(filepath)):
+        os.remove(log_filepath_for(filepath))
+
+SEARCH_TOKEN_PATTERN = re.compile(r'\w+')
+
+def search_tokens(text):
+    return set(SEARCH_TOKEN_PATTERN.findall(text.lower()))
+
+# Sidecar file in the day file directory mapping the lower-cased words of task
+# names and descriptions to the days and tasks using them. Once it exists, a
+# save appends the entries of its day to the index's log whenever the names or
+# descriptions of the day changed; days missing from the index are added at
+# the next search.
+class SearchIndex:
+    FILE_NAME = 'search_index.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.filepath = os.path.join(directory, self.FILE_NAME)
+        # day -> {'file': file name, 'entries': [[name, description], ...]}
+        self.days = {}
+        # token -> [[day, name], ...]
+        self.tokens = {}
+        self.sorted_tokens = None
+        self.changed = False
+        if os.path.isfile(self.filepath):
+            try:
+                with open(self.filepath, 'r') as file:
+                    data = json.load(file)
+                self.days = data['days']
+                self.tokens = data['tokens']
+            except (ValueError, KeyError):
+                self.days = {}
+                self.tokens = {}
+            for update in read_sidecar_log(self.filepath):
+                self.update_day(date.fromisoformat(update['day']), update['file'], update['entries'])
+            # the log holds the days replayed, only new changes need a snapshot
+            self.changed = False
+
+    @staticmethod
+    def exists(directory):
+        return os.path.isfile(os.path.join(directory, SearchIndex.FILE_NAME))
+
+    @staticmethod
+    def append_day(directory, day, file_name, entries):
+        # called with the DirectoryLock of directory held
+        filepath = os.path.join(directory, SearchIndex.FILE_NAME)
+        size = append_to_sidecar_log(filepath, {'day': day.isoformat(), 'file': file_name, 'entries': entries})
+        if size > LOG_COMPACTION_THRESHOLD:
+            index = SearchIndex(directory)
+            index.changed = True
+            index.save()
+
+    @staticmethod
+    def entries_of(tasks):
+        return sorted([task.name, task.description] for task in tasks)
+
+    def update_day(self, day, file_name, entries):
+        day = day.isoformat()
+        if day in self.days:
+            for name, description in self.days[day]['entries']:
+                for token in search_tokens(name + ' ' + description):
+                    refs = [ref for ref in self.tokens.get(token, []) if ref != [day, name]]
+                    if refs:
+                        self.tokens[token] = refs
+                    else:
+                        self.tokens.pop(token, None)
+        self.days[day] = {'file': file_name, 'entries': entries}
+        for name, description in entries:
+            for token in search_tokens(name + ' ' + description):
+                refs = self.tokens.setdefault(token, [])
+                if [day, name] not in refs:
+                    refs.append([day, name])
+        self.sorted_tokens = None
+        self.changed = True
+
+    def refresh(self, rebuild=False):
+        # adds days missing from the index and drops days whose file is gone
+        day_files = find_day_files(self.directory)
+        if rebuild:
+            self.days = {}
+            self.tokens = {}
+        known = {day.isoformat() for day, path in day_files}
+        for day in [day for day in self.days if day not in known]:
+            self.update_day(date.fromisoformat(day), None, [])
+            del self.days[day]
+        for day, path in day_files:
+            if day.isoformat() not in self.days:
+                self.update_day(day, os.path.basename(path), SearchIndex.entries_of(TimeLogger(path).tasks))
+        self.save()
+
+    def save(self):
+        if not self.changed:
+            return
+        write_sidecar_snapshot(self.filepath, json.dumps({'version': 1, 'days': self.days, 'tokens': self.tokens}))
+        self.changed = False
+
+    def find(self, query, mode='prefix'):
+        # (day, task name) pairs: 'prefix' matches words of names and descriptions
+        # starting with every word of query, 'substring' and 'regex' match whole
+        # names and descriptions
+        matches = set()
+        if mode == 'prefix':
+            if self.sorted_tokens is None:
+                self.sorted_tokens = sorted(self.tokens)
+            found = None
+            for word in search_tokens(query):
+                refs = set()
+                first = bisect.bisect_left(self.sorted_tokens, word)
+                for token in self.sorted_tokens[first:bisect.bisect_left(self.sorted_tokens, word + '\uffff')]:
+                    refs.update((day, name) for day, name in self.tokens[token])
+                found = refs if found is None else found & refs
+            matches = found or set()
+        else:
+            if mode == 'regex':
+                pattern = re.compile(query, re.IGNORECASE)
+                matcher = lambda text: pattern.search(text) is not None
+            else:
+                matcher = lambda text: query.lower() in text.lower()
+            for day, entry in self.days.items():
+                for name, description in entry['entries']:
+                    if matcher(name) or matcher(description):
+                        matches.add((day, name))
+        return sorted(matches, reverse=True)
+
+    def search(self, query, mode='prefix'):
+        # matching days, newest first, with the hours of the matching tasks taken
+        # from the summary cache
+        matches = self.find(query, mode)
+        days = []
+        for day, name in matches:
+            if not days or days[-1]['date'] != day:
+                days.append({'date': day, 'file': self.days[day]['file'], 'tasks': {}, 'hours': 0})
+            days[-1]['tasks'][name] = 0
+        day_files = [(date.fromisoformat(day['date']), os.path.join(self.directory, day['file'])) for day in days]
+        now = time.time()
+        for day, summary in zip(days, SummaryCache(self.directory).day_summaries(day_files)):
+            for name in day['tasks']:
+                if name in summary['tasks']:
+                    day['tasks'][name] = summary_hours(summary['tasks'][name], now)
+            day['hours'] = sum(day['tasks'].values())
+        return days
+
+# Task names of all days ranked for completion. A name scores once per day it
+# was used and every use loses half its weight each VOCABULARY_HALF_LIFE_DAYS,
+# so names used often and lately come first. Scores are stored as logarithms of
+# the weights counted from a fixed epoch on, which keeps the score of a name
+# comparable to all others without ever rescaling them when days are added.
+# The names of each day are kept as well, so a save appends the names of its
+# day to the vocabulary's log and replaying it needs nothing else.
+VOCABULARY_HALF_LIFE_DAYS = 30
+VOCABULARY_EPOCH = date(2000, 1, 1)
+
+class Vocabulary:
+    FILE_NAME = 'vocabulary.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.filepath = os.path.join(directory, self.FILE_NAME)
+        self.scores = {}
+        # day -> names used on the day
+        self.days = {}
+        self.loaded = False
+        self.changed = False
+        if os.path.isfile(self.filepath):
+            try:
+                with open(self.filepath, 'r') as file:
+                    data = json.load(file)
+                if data['half_life_days'] == VOCABULARY_HALF_LIFE_DAYS and data['epoch'] == VOCABULARY_EPOCH.isoformat():
+                    self.scores = data['names']
+                    self.days = data['days']
+                    self.loaded = True
+            except (ValueError, KeyError):
+                self.scores = {}
+                self.days = {}
+        if self.loaded:
+            for update in read_sidecar_log(self.filepath):
+                self.update_day(date.fromisoformat(update['day']), update['names'])
+            # the log holds the days replayed, only new changes need a snapshot
+            self.changed = False
+
+    @staticmethod
+    def exists(directory):
+        return os.path.isfile(os.path.join(directory, Vocabulary.FILE_NAME))
+
+    @staticmethod
+    def load_or_build(directory, storage=None):
+        if storage is not None:
+            # days kept in a database have no vocabulary file, their names are read in one query
+            vocabulary = Vocabulary(directory)
+            vocabulary.rebuild(storage)
+            return vocabulary
+        # the history is scanned only while there is no usable vocabulary file
+        with DirectoryLock(directory):
+            vocabulary = Vocabulary(directory)
+            if not vocabulary.loaded:
+                vocabulary.rebuild()
+                vocabulary.save()
+        return vocabulary
+
+    @staticmethod
+    def append_day(directory, day, names):
+        # called with the DirectoryLock of directory held
+        filepath = os.path.join(directory, Vocabulary.FILE_NAME)
+        if append_to_sidecar_log(filepath, {'day': day.isoformat(), 'names': names}) > LOG_COMPACTION_THRESHOLD:
+            vocabulary = Vocabulary(directory)
+            if not vocabulary.loaded:
+                vocabulary.rebuild()
+            vocabulary.changed = True
+            vocabulary.save()
+
+    @staticmethod
+    def weight(day):
+        # logarithm of the weight of one use on day
+        return (day - VOCABULARY_EPOCH).days / VOCABULARY_HALF_LIFE_DAYS * math.log(2)
+
+    def add(self, name, day):
+        weight = Vocabulary.weight(day)
+        score = self.scores.get(name)
+        if score is None:
+            self.scores[name] = weight
+        else:
+            self.scores[name] = max(score, weight) + math.log1p(math.exp(-abs(score - weight)))
+        self.changed = True
+
+    def remove(self, name, day):
+        score = self.scores.get(name)
+        if score is None:
+            return
+        weight = Vocabulary.weight(day)
+        if weight >= score - 1e-9:
+            # that use was all that was left of the name
+            del self.scores[name]
+        else:
+            self.scores[name] = score + math.log1p(-math.exp(weight - score))
+        self.changed = True
+
+    def update_day(self, day, names):
+        # names are all names of the day, the ones it had before are replaced
+        old_names = set(self.days.get(day.isoformat(), []))
+        for name in old_names - set(names):
+            self.remove(name, day)
+        for name in set(names) - old_names:
+            self.add(name, day)
+        if names:
+            self.days[day.isoformat()] = sorted(set(names))
+        else:
+            self.days.pop(day.isoformat(), None)
+
+    def rebuild(self, storage=None):
+        self.scores = {}
+        self.days = {}
+        if storage is not None:
+            for day, names in storage.day_names().items():
+                self.update_day(day, names)
+        else:
+            for day, path in find_day_files(self.directory):
+                self.update_day(day, [task.name for task in TimeLogger(path).tasks])
+        self.changed = True
+
+    def ranked(self, limit=None):
+        return sorted(self.scores, key=lambda name: (-self.scores[name], name))[:limit]
+
+    def save(self):
+        if not self.changed or not os.path.isdir(self.directory):
+            return
+        data = {'version': 2, 'half_life_days': VOCABULARY_HALF_LIFE_DAYS, 'epoch': VOCABULARY_EPOCH.isoformat(),
+                'names': {name: round(score, 9) for name, score in self.scores.items()}, 'days': self.days}
+        write_sidecar_snapshot(self.filepath, json.dumps(data, separators=(',', ':')))
+        self.changed = False
+
+def empty_report_totals():
+    return {'total': 0, 'paid': 0, 'unpaid': 0}
+
+def add_to_report_totals(totals, task_name, hours):
+    totals['total'] += hours
+    totals['unpaid' if task_name.startswith('.') else 'paid'] += hours
+
+def summarize_day_files(paths, processes=None):
+    workers = processes or os.cpu_count() or 1
+    if workers == 1 or len(paths) < REPORT_POOL_THRESHOLD:
+        return [summarize_day_file(path) for path in paths]
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        chunksize = max(1, len(paths) // (4 * workers))
+        return list(executor.map(summarize_day_file, paths, chunksize=chunksize))
+
+def build_report(directory, first_day=None, last_day=None, processes=None, use_cache=True):
+    day_files = find_day_files(directory, first_day, last_day)
+    if use_cache:
+        summaries = SummaryCache(directory).day_summaries(day_files, processes)
+    else:
+        summaries = summarize_day_files([path for day, path in day_files], processes)
+    return aggregate_report(summaries)
+
+def aggregate_report(summaries):
+    now = time.time()
+    report = {'totals': empty_report_totals(), 'tasks': {}, 'days': {}, 'weeks': {}, 'months': {}}
+    for summary in summaries:
+        day = datetime.strptime(summary['date'], '%Y-%m-%d').date()
+        year, week, _ = day.isocalendar()
+        periods = [
+            report['days'].setdefault(summary['date'], empty_report_totals()),
+            report['weeks'].setdefault(f"{year}-W{week:02d}", empty_report_totals()),
+            report['months'].setdefault(day.strftime('%Y-%m'), empty_report_totals()),
+            report['totals'],
+        ]
+        for task_name, task_summary in summary['tasks'].items():
+            hours = summary_hours(task_summary, now)
+            report['tasks'][task_name] = report['tasks'].get(task_name, 0) + hours
+            for totals in periods:
+                add_to_report_totals(totals, task_name, hours)
+    return report
+
+def print_report(report):
+    def print_totals(label, totals):
+        line = f"{label.ljust(12)} {format_hours(totals['total']).rjust(9,'.')}"
+        if totals['unpaid'] != 0:
+            line += f"  (paid {format_hours(totals['paid'])}, unpaid {format_hours(totals['unpaid'])})"
+        print(line)
+    for title in ['days', 'weeks', 'months']:
+        print(title.capitalize() + ':')
+        for label, totals in report[title].items():
+            print_totals(label, totals)
+        print()
+    print('Tasks:')
+    for task_name, hours in sorted(report['tasks'].items(), key=lambda item: -item[1]):
+        print(f"{format_hours(hours).rjust(9,'.')} {task_name}")
+    print()
+    print_totals('Total', report['totals'])
+
+def parse_day(day_string):
+    return datetime.strptime(day_string, '%Y-%m-%d').date()
+
+def command_report(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog='timelogger.py report', description='Summarize the logged time of a date range')
+    parser.add_argument('--from', dest='first_day', type=parse_day, help='first day to include (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='last_day', type=parse_day, help='last day to include (YYYY-MM-DD)')
+    parser.add_argument('--dir', dest='directory', default='./.timelogger/', help='directory holding the day files')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='ignore and do not update the summary cache')
+    options = parser.parse_args(args)
+    report = build_report(options.directory, options.first_day, options.last_day, options.processes, options.use_cache)
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+# Keeps all days in one SQLite database instead of a JSON file per day, with
+# tasks indexed by name and blocks by start and end, so questions across days
+# are answered by one query. A save replaces the day in one transaction and
+# counts up the day's version, which tells a TimeLogger that another process
+# saved the day since it was loaded, as the signature of a day file does.
+class SqliteStorage:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            day TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS tasks_by_day ON tasks (day, position);
+        CREATE INDEX IF NOT EXISTS tasks_by_name ON tasks (name, day);
+        CREATE TABLE IF NOT EXISTS blocks (
+            task_id INTEGER NOT NULL REFERENCES tasks (id),
+            start REAL,
+            end REAL
+        );
+        CREATE INDEX IF NOT EXISTS blocks_by_task ON blocks (task_id, start);
+        CREATE INDEX IF NOT EXISTS blocks_by_start ON blocks (start);
+        CREATE INDEX IF NOT EXISTS blocks_by_end ON blocks (end);
+        CREATE TABLE IF NOT EXISTS days (
+            day TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, filepath):
+        # imported here, so the JSON storage does not pay for it
+        import sqlite3
+        directory = os.path.dirname(filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.filepath = filepath
+        self.connection = sqlite3.connect(filepath)
+        with self.connection:
+            self.connection.executescript(self.SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def load_tasks(self, day):
+        tasks = []
+        task_ids = {}
+        for task_id, name, description in self.connection.execute(
+                "SELECT id, name, description FROM tasks WHERE day = ? ORDER BY position", (day.isoformat(),)):
+            task = Task(name, day)
+            task.description = description
+            task_ids[task_id] = task
+            tasks.append(task)
+        for task_id, start, end in self.connection.execute(
+                "SELECT blocks.task_id, blocks.start, blocks.end FROM blocks JOIN tasks ON tasks.id = blocks.task_id"
+                " WHERE tasks.day = ? ORDER BY blocks.task_id, blocks.end IS NULL, blocks.start", (day.isoformat(),)):
+            task_ids[task_id].time_blocks.append(TimeBlock.from_timestamps(start, end))
+        return tasks
+
+    def save_tasks(self, day, tasks):
+        with self.transaction():
+            self.write_day(day, tasks)
+
+    def transaction(self):
+        # used as "with storage.transaction():", the connection commits or rolls back
+        # at the end; BEGIN IMMEDIATE takes the write lock before anything is read
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def day_version(self, day):
+        row = self.connection.execute("SELECT version FROM days WHERE day = ?", (day.isoformat(),)).fetchone()
+        return None if row is None else row[0]
+
+    def write_day(self, day, tasks):
+        self.connection.execute(
+            "INSERT INTO days (day, version) VALUES (?, 1) ON CONFLICT (day) DO UPDATE SET version = version + 1", (day.isoformat(),))
+        self.connection.execute("DELETE FROM blocks WHERE task_id IN (SELECT id FROM tasks WHERE day = ?)", (day.isoformat(),))
+        self.connection.execute("DELETE FROM tasks WHERE day = ?", (day.isoformat(),))
+        for position, task in enumerate(tasks):
+            task_id = self.connection.execute(
+                "INSERT INTO tasks (day, position, name, description) VALUES (?, ?, ?, ?)",
+                (day.isoformat(), position, task.name, task.description)).lastrowid
+            self.connection.executemany(
+                "INSERT INTO blocks (task_id, start, end) VALUES (?, ?, ?)",
+                [(task_id, block.start, block.end) for block in task.time_blocks])
+
+    def days(self):
+        return [date.fromisoformat(day) for day, in self.connection.execute("SELECT DISTINCT day FROM tasks ORDER BY day")]
+
+    def day_names(self):
+        # day -> names of the tasks of the day
+        names = {}
+        for day, name in self.connection.execute("SELECT day, name FROM tasks ORDER BY day"):
+            names.setdefault(date.fromisoformat(day), []).append(name)
+        return names
+
+    def blocks_of_task(self, name, first_day=None, last_day=None):
+        # (day, start, end) of all blocks of the task, end is None for open blocks
+        query = "SELECT tasks.day, blocks.start, blocks.end FROM tasks JOIN blocks ON blocks.task_id = tasks.id WHERE tasks.name = ?"
+        parameters = [name]
+        if first_day is not None:
+            query += " AND tasks.day >= ?"
+            parameters.append(first_day.isoformat())
+        if last_day is not None:
+            query += " AND tasks.day <= ?"
+            parameters.append(last_day.isoformat())
+        query += " ORDER BY blocks.start"
+        return [(date.fromisoformat(day), start, end) for day, start, end in self.connection.execute(query, parameters)]
+
+    def tasks_at(self, timestamp):
+        # names of the tasks booked at timestamp; blocks end on their day, so only
+        # blocks starting in the 24 hours before are looked at
+        return [name for name, in self.connection.execute(
+            "SELECT DISTINCT tasks.name FROM blocks JOIN tasks ON tasks.id = blocks.task_id"
+            " WHERE blocks.start BETWEEN ? AND ? AND (blocks.end > ? OR blocks.end IS NULL)",
+            (timestamp - 24 * 3600, timestamp, timestamp))]
+
+    def import_json_tree(self, directory):
+        # copies every JSON day file of directory into the database in one transaction
+        day_files = find_day_files(directory)
+        with self.transaction():
+            for day, path in day_files:
+                self.write_day(day, TimeLogger(path).tasks)
+        return len(day_files)
+
+def command_import_sqlite(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog='timelogger.py import-sqlite', description='Copy the JSON day files into an SQLite database')
+    parser.add_argument('--dir', dest='directory', default='./.timelogger/', help='directory holding the day files')
+    parser.add_argument('--db', dest='database', default='./.timelogger/timelogger.sqlite3', help='SQLite database to write')
+    options = parser.parse_args(args)
+    storage = SqliteStorage(options.database)
+    count = storage.import_json_tree(options.directory)
+    storage.close()
+    print(f"Imported {count} days into {options.database}")
+
+def command_search(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog='timelogger.py search', description='Find the days a task name or description was used on')
+    parser.add_argument('query', help='words to look for')
+    parser.add_argument('--mode', choices=['prefix', 'substring', 'regex'], default='prefix',
+                        help='prefix: words starting with the query words, substring and regex: anywhere in names and descriptions')
+    parser.add_argument('--dir', dest='directory', default='./.timelogger/', help='directory holding the day files')
+    parser.add_argument('--rebuild', action='store_true', help='index all day files again')
+    parser.add_argument('--json', action='store_true', help='print the matches as JSON')
+    options = parser.parse_args(args)
+    with DirectoryLock(options.directory):
+        index = SearchIndex(options.directory)
+        index.refresh(options.rebuild)
+    days = index.search(options.query, options.mode)
+    if options.json:
+        print(json.dumps(days, indent=2))
+        return
+    for day in days:
+        print(f"{day['date']} {format_hours(day['hours']).rjust(9,'.')}  {', '.join(day['tasks'])}")
+
+def iter_days(directory, first_day=None, last_day=None, storage=None):
+    # (day, tasks) of every stored day in the range, loading one day at a time;
+    # the tasks are read only, so they are kept in the compact columnar form
+    if storage is not None:
+        for day in storage.days():
+            if (first_day is None or day >= first_day) and (last_day is None or day <= last_day):
+                yield day, [task.compact() for task in storage.load_tasks(day)]
+        return
+    for day, path in find_day_files(directory, first_day, last_day):
+        yield day, [task.compact() for task in TimeLogger(path).tasks]
+
+EXPORT_FORMATS = ['csv', 'ics', 'jsonl']
+EXPORT_FIELDS = ['date', 'task', 'description', 'unpaid', 'start', 'end', 'hours', 'open']
+
+def export_rows(days, open_blocks='keep', now=None):
+    # One row per block, day by day. Open blocks (end None) are kept with an
+    # empty end ('keep'), end at now ('now') or are left out ('skip'); the open
+    # field tells which rows had no end.
+    now = time.time() if now is None else now
+    for day, tasks in days:
+        for task in tasks:
+            for block in task.time_blocks:
+                if block.start is None:
+                    continue
+                end = block.end
+                if end is None:
+                    if open_blocks == 'skip':
+                        continue
+                    if open_blocks == 'now':
+                        end = max(now, block.start)
+                yield {
+                    'date': day.isoformat(),
+                    'task': task.name,
+                    'description': task.description,
+                    'unpaid': task.is_unpaid(),
+                    'start': block.start,
+                    'end': end,
+                    'hours': None if end is None else round((end - block.start) / 3600, 4),
+                    'open': block.end is None,
+                }
+
+def local_iso(timestamp):
+    return None if timestamp is None else datetime.fromtimestamp(timestamp).isoformat(timespec='seconds')
+
+def write_csv(rows, stream):
+    import csv
+    writer = csv.writer(stream)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        row = dict(row, start=local_iso(row['start']), end=local_iso(row['end']))
+        writer.writerow(['' if row[field] is None else row[field] for field in EXPORT_FIELDS])
+
+def write_jsonl(rows, stream):
+    for row in rows:
+        stream.write(json.dumps(dict(row, start=local_iso(row['start']), end=local_iso(row['end']))) + '\n')
+
+def ics_text(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def ics_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def ics_line(line):
+    # lines longer than 75 octets of UTF-8 are folded onto continuation lines,
+    # which start with a space; characters are not split across lines
+    if len(line.encode()) <= 75:
+        return line + '\r\n'
+    parts = []
+    part = ''
+    size = 0
+    limit = 75
+    for char in line:
+        char_size = len(char.encode())
+        if size + char_size > limit:
+            parts.append(part)
+            part = ''
+            size = 0
+            limit = 74
+        part += char
+        size += char_size
+    parts.append(part)
+    return '\r\n '.join(parts) + '\r\n'
+
+def write_ics(rows, stream):
+    # open blocks kept without end are written without DTEND
+    stamp = ics_time(time.time())
+    stream.write(ics_line('BEGIN:VCALENDAR') + ics_line('VERSION:2.0') + ics_line('PRODID:-//TimeLogger//EN'))
+    for row in rows:
+        uid = snapshot_hash_of(f"{row['task']}\n{row['start']}".encode())[:20]
+        lines = ['BEGIN:VEVENT', f"UID:{uid}@timelogger", f"DTSTAMP:{stamp}", f"DTSTART:{ics_time(row['start'])}"]
+        if row['end'] is not None:
+            lines.append(f"DTEND:{ics_time(row['end'])}")
+        lines.append(f"SUMMARY:{ics_text(row['task'])}")
+        if row['description']:
+            lines.append(f"DESCRIPTION:{ics_text(row['description'])}")
+        lines.append('TRANSP:TRANSPARENT' if row['unpaid'] else 'TRANSP:OPAQUE')
+        lines.append('CATEGORIES:' + ('unpaid' if row['unpaid'] else 'paid') + (',open' if row['open'] else ''))
+        lines.append('END:VEVENT')
+        stream.write(''.join(ics_line(line) for line in lines))
+    stream.write(ics_line('END:VCALENDAR'))
+
+def export_days(days, export_format, stream, open_blocks='keep', now=None):
+    writers = {'csv': write_csv, 'ics': write_ics, 'jsonl': write_jsonl}
+    writers[export_format](export_rows(days, open_blocks, now), stream)
+
+def command_export(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog='timelogger.py export', description='Export the time blocks of a date range')
+    parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='csv', help='output format')
+    parser.add_argument('--from', dest='first_day', type=parse_day, help='first day to include (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='last_day', type=parse_day, help='last day to include (YYYY-MM-DD)')
+    parser.add_argument('--dir', dest='directory', default='./.timelogger/', help='directory holding the day files')
+    parser.add_argument('--db', dest='database', default=None, help='export from this SQLite database instead')
+    parser.add_argument('--open', dest='open_blocks', choices=['keep', 'now', 'skip'], default='keep',
+                        help='open blocks: keep without end, end them now or skip them')
+    parser.add_argument('--output', default='-', help="file to write, '-' for stdout")
+    options = parser.parse_args(args)
+    storage = SqliteStorage(options.database) if options.database else None
+    days = iter_days(options.directory, options.first_day, options.last_day, storage)
+    if options.output == '-':
+        export_days(days, options.export_format, sys.stdout, options.open_blocks)
+    else:
+        with open(options.output, 'w', newline='') as file:
+            export_days(days, options.export_format, file, options.open_blocks)
+
+def day_file_status(directory):
+    # the status of today read from today's day file, for when no status.json is there
+    filepath = os.path.join(directory, datetime.now().strftime("%Y-%m-%d_%A.json"))
+    status = {'task': None, 'start': None}
+    if os.path.isfile(filepath):
+        task = TimeLogger(filepath).get_current_task()
+        if task is not None:
+            status = {'task': task.name, 'start': task.summary()['open_start']}
+    return status
+
+def command_status(args):
+    print(status_line(*args[:1]))
+
+# Draws frames with ANSI escape sequences instead of clearing the terminal: only
+# the lines that differ from the previous frame are rewritten. The scrolling
+# part of a frame is cut to a viewport when it does not fit the terminal.
+class ScreenRenderer:
+    # rows kept free below a frame for the prompt
+    PROMPT_ROWS = 3
+
+    def __init__(self, stream=None, size=None):
+        self.stream = stream
+        self.size = size
+        self.previous = None
+
+    def terminal_size(self):
+        if self.size is not None:
+            return self.size
+        try:
+            size = os.get_terminal_size()
+            return size.columns, size.lines
+        except OSError:
+            return 80, 24
+
+    def viewport(self, rows, height, focus=0):
+        if len(rows) <= height:
+            return rows
+        height = max(1, height - 1)
+        first = min(max(0, focus - height // 2), len(rows) - height)
+        hidden_after = len(rows) - first - height
+        return rows[first:first + height] + [f"... {first} up, {hidden_after} down"]
+
+    def frame(self, header, rows=(), footer=(), focus=0):
+        columns, lines = self.terminal_size()
+        height = lines - self.PROMPT_ROWS - len(header) - len(footer)
+        frame = list(header) + self.viewport(list(rows), height, focus) + list(footer)
+        return [line[:columns] for line in frame]
+
+    def render(self, header, rows=(), footer=(), focus=0, keep_cursor=False):
+        # keep_cursor redraws around a pending prompt: the cursor is saved and
+        # restored and nothing below the frame is touched
+        frame = self.frame(header, rows, footer, focus)
+        if keep_cursor and (self.previous is None or len(frame) != len(self.previous)):
+            return
+        output = []
+        if self.previous is None:
+            output.append("\x1b[H\x1b[2J")
+        for index, line in enumerate(frame):
+            previous_line = self.previous[index] if self.previous is not None and index < len(self.previous) else None
+            if previous_line == line:
+                continue
+            # unchanged leading cells of the line are skipped
+            column = 0
+            if previous_line is not None:
+                while column < min(len(line), len(previous_line)) and line[column] == previous_line[column]:
+                    column += 1
+            output.append(f"\x1b[{index + 1};{column + 1}H{line[column:]}\x1b[K")
+        if keep_cursor:
+            if not output:
+                return
+            output = ["\x1b7"] + output + ["\x1b8"]
+        else:
+            # whatever is below the frame (the last prompt) is cleared
+            output.append(f"\x1b[{len(frame) + 1};1H\x1b[J")
+        stream = self.stream or sys.stdout
+        stream.write(''.join(output))
+        stream.flush()
+        self.previous = frame
+
+@traced('redraw')
+def draw_day(renderer, tl, messages=(), show_summary=True, keep_cursor=False):
+    header = list(messages)
+    rows = []
+    footer = []
+    focus = 0
+    if show_summary:
+        snapshot = tl.snapshot()
+        header += ['LOG stored in: ' + tl.filepath, ''] + tl.summary_header_lines(snapshot)
+        rows = tl.summary_row_lines(snapshot)
+        focus = next((row['id'] for row in snapshot.rows if row['active']), 0)
+        footer = [''] + tl.percentage_lines(snapshot)
+    renderer.render(header, rows, footer, focus, keep_cursor)
+
+# Seconds between two redraws of the live mode. A tick without visible change
+# writes nothing, so a tick costs about one snapshot of the day.
+LIVE_TICK_INTERVAL = 1.0
+
+def read_in_thread(loop, read_command):
+    # input() blocks, so it runs in a daemon thread that never holds up exiting
+    import threading
+    future = loop.create_future()
+    def deliver(result, error):
+        if future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+    def read():
+        try:
+            result = read_command()
+        except BaseException as error:
+            loop.call_soon_threadsafe(deliver, None, error)
+        else:
+            loop.call_soon_threadsafe(deliver, result, None)
+    threading.Thread(target=read, daemon=True).start()
+    return future
+
+def run_and_draw(tl, renderer, command):
+    # runs one command and draws the resulting screen, returns the lines the
+    # command printed or None on exit
+    import contextlib
+    import io
+    if TRACER is not None:
+        TRACER.begin(command)
+    try:
+        tl.reload_if_changed()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            running = run_command(tl, command)
+        if not running:
+            return None
+        if command != "help":
+            tl.save_tasks_to_file()
+        messages = output.getvalue().splitlines() + tl.pop_conflicts()
+        draw_day(renderer, tl, messages, command != "help")
+        return messages
+    finally:
+        if TRACER is not None:
+            TRACER.end(tl)
+
+async def live_loop(tl, read_command, renderer, interval=LIVE_TICK_INTERVAL):
+    import asyncio
+    loop = asyncio.get_running_loop()
+    command = ''
+    while True:
+        messages = run_and_draw(tl, renderer, command)
+        if messages is None:
+            break
+        show_summary = command != "help"
+
+        pending = read_in_thread(loop, read_command)
+        while True:
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if done:
+                break
+            if show_summary:
+                draw_day(renderer, tl, messages, show_summary, keep_cursor=True)
+        command = pending.result().strip()
+
+def run_command(tl, command):
+    # Applies one command of the interactive grammar, returns False on exit
+    if command == "":
+        pass
+    elif command == "exit" or command == "q":
+        return False
+    elif command == ">":
+        tl.command_next_day()
+    elif command == "<":
+        tl.command_prev_day()
+    elif command.startswith("rm "):
+        tl.keep_history()
+        tl.command_remove(command)
+    elif command == "stop" or command == "x":
+        tl.keep_history()
+        tl.command_stop()
+    elif command == "undo":
+        tl.undo()
+    elif command == "redo":
+        tl.redo()
+    elif command == "help":
+        tl.command_help()
+    else:
+        tl.keep_history()
+        tl.command_create_rename_merge(command)
+    return True
+
+def run_batch(tl, lines):
+    # Applies the commands of lines (one per line, '#' starts a comment line) with
+    # a single normalization and save per day instead of one per command
+    tl.defer_normalization = True
+    try:
+        for line in lines:
+            command = line.strip()
+            if command.startswith('#'):
+                continue
+            if TRACER is not None:
+                TRACER.begin(command)
+            try:
+                if command == ">" or command == "<":
+                    tl.save_tasks_to_file()
+                elif command == "undo" or command == "redo":
+                    tl.flush_normalization()
+                running = run_command(tl, command)
+            finally:
+                if TRACER is not None:
+                    TRACER.end(tl)
+            if not running:
+                break
+    finally:
+        tl.defer_normalization = False
+    if TRACER is not None:
+        TRACER.begin('(batch save)')
+    tl.save_tasks_to_file()
+    if TRACER is not None:
+        TRACER.end(tl)
+
+def command_batch(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog='timelogger.py batch', description='Apply commands read from a script file or stdin')
+    parser.add_argument('script', nargs='?', default='-', help="file with one command per line, '-' reads stdin")
+    parser.add_argument('--file', dest='filepath', default='./.timelogger/' + datetime.now().strftime("%Y-%m-%d_%A.json"), help='day file to start with')
+    parser.add_argument('--json', action='store_true', help='print the resulting summary as JSON')
+    parser.add_argument('--db', dest='database', default=None, help='keep the days in this SQLite database instead of JSON files')
+    parser.add_argument('--undo-budget', dest='undo_budget', type=int, default=UNDO_BUDGET, help='task references and time blocks the undo history keeps per day')
+    options = parser.parse_args(args)
+    tl = TimeLogger(options.filepath, SqliteStorage(options.database) if options.database else None, options.undo_budget)
+    if options.script == '-':
+        run_batch(tl, sys.stdin)
+    else:
+        with open(options.script, 'r') as file:
+            run_batch(tl, file)
+    for conflict in tl.pop_conflicts():
+        print(conflict, file=sys.stderr)
+    if options.json:
+        print(json.dumps(tl.get_summary(), indent=2))
+    else:
+        snapshot = tl.snapshot()
+        print('LOG stored in: ' + tl.filepath)
+        print()
+        tl.show_task_summary(snapshot)
+        print()
+        tl.show_task_percentages(snapshot)
+        print()
 
 def load_lines_to_list(file_path):
     with open(file_path, "r") as file:
@@ -627,62 +3013,81 @@ def load_lines_to_list(file_path):
     return lines
 
 
+def pop_option(args, name):
+    # removes "name value" from args and returns the value
+    if name not in args or args.index(name) + 1 >= len(args):
+        return None
+    index = args.index(name)
+    value = args[index + 1]
+    del args[index:index + 2]
+    return value
+
 def main():
+    trace_filepath = pop_option(sys.argv, '--trace')
+    profile_count = pop_option(sys.argv, '--profile')
+    if trace_filepath is not None:
+        start_tracing(trace_filepath, int(profile_count or 0))
+    try:
+        run_cli()
+    finally:
+        stop_tracing()
+
+def run_cli():
     path = './.timelogger/'
     filepath = path + datetime.now().strftime("%Y-%m-%d_%A.json")
     auto_complete_filepath = path + 'auto_complete.csv'
 
+    if len(sys.argv) > 1 and sys.argv[1] == '--status':
+        command_status(sys.argv[2:])
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'report':
+        command_report(sys.argv[2:])
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        command_batch(sys.argv[2:])
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'search':
+        command_search(sys.argv[2:])
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'export':
+        command_export(sys.argv[2:])
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'import-sqlite':
+        command_import_sqlite(sys.argv[2:])
+        return
+
+    database = pop_option(sys.argv, '--db')
+    undo_budget = int(pop_option(sys.argv, '--undo-budget') or UNDO_BUDGET)
     if len(sys.argv) > 1:
         for arg in sys.argv:
             if arg.endswith('.json'):
                 filepath = arg
 
-    tl = TimeLogger(filepath)
+    tl = TimeLogger(filepath, SqliteStorage(database) if database else None, undo_budget)
+    tl.prefetch_neighbours()
     auto_complete_list = ["Example auto complete", "Add a list of auto-completions as .timelogger/auto_complete.csv"]
     if os.path.exists(auto_complete_filepath):
         auto_complete_list = load_lines_to_list(auto_complete_filepath)
-    completer = AutoCompleter(['exit', 'rm ', 'stop', 'help', 'undo', 'redo'], auto_complete_list)
+    completer = AutoCompleter(['exit', 'rm ', 'stop', 'help', 'undo', 'redo'], auto_complete_list, fuzzy_limit=10)
+    completer.history = Vocabulary.load_or_build('/'.join(tl.parrent_dir), tl.storage).ranked()
+    renderer = ScreenRenderer()
+    if '--live' in sys.argv:
+        import asyncio
+        read_command = lambda: completer.get_cli_input(tl.tasks, '\n[Tab] to auto-complete > ', tl.current_datetime)
+        asyncio.run(live_loop(tl, read_command, renderer))
+        return
+
     command = ''
     params = []
     while True:
-        os.system('cls' if os.name == 'nt' else 'clear')
-
-        if command == "":
-            pass
-        elif command == "exit" or command == "q":
-            break
-        elif command == ">":
-            tl.command_next_day()
-        elif command == "<":
-            tl.command_prev_day()
-        elif command.startswith("rm "):
-            tl.keep_history()
-            tl.command_remove(command)
-        elif command == "stop" or command == "x":
-            tl.keep_history()
-            tl.command_stop()
-        elif command == "exit":
+        # output of the command is captured and drawn as part of the next frame
+        if run_and_draw(tl, renderer, command) is None:
             break
-        elif command == "undo":
-            tl.undo()
-        elif command == "redo":
-            tl.redo()
-        elif command == "help":
-            tl.command_help()
-        else:
-            tl.keep_history()
-            tl.command_create_rename_merge(command)
-
-        if command != "help":
-            tl.save_tasks_to_file()
-
-            print('LOG stored in: ' + tl.filepath)
-            print()
-            tl.show_task_summary()
-            print()
-            tl.show_task_percentages()
-            print()
-        print()
 
         command = completer.get_cli_input(tl.tasks, '\n[Tab] to auto-complete > ', tl.current_datetime).strip()
 
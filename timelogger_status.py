@@ -0,0 +1,43 @@
+#/bin/python3
+
+# Prints the active task and its elapsed time for shell prompts. It only reads
+# the status.json that timelogger.py keeps next to the day files, so a prompt
+# does not pay for compiling and importing all of timelogger.py; without a
+# status of today it falls back to reading today's day file through timelogger.
+
+import json
+import os
+import sys
+import time
+
+STATUS_FILE_NAME = 'status.json'
+
+def format_hours(hours):
+    h = int(hours)
+    m = int((hours - int(hours)) * 60)
+    if h == 0:
+        return f"{m}m"
+    else:
+        return f"{h}h+{m}m"
+
+def status_line(directory='./.timelogger/'):
+    status = None
+    try:
+        with open(os.path.join(directory, STATUS_FILE_NAME), 'r') as file:
+            status = json.load(file)
+    except (OSError, ValueError):
+        pass
+    if status is None or status.get('date') != time.strftime('%Y-%m-%d'):
+        # no status of today was saved, look at today's day file instead
+        import timelogger
+        status = timelogger.day_file_status(directory)
+    if status['task'] is None:
+        return 'No active task'
+    return f"{status['task']} {format_hours((time.time() - status['start']) / 3600)}"
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    print(status_line(*args[:1]))
+
+if __name__ == "__main__":
+    main()